@@ -0,0 +1,88 @@
+"""Изменение изображений альбома минимальным набором операций.
+
+Желаемое состояние - упорядоченный список, где int означает существующее
+изображение (по id), а str - новое изображение по URL. По разнице с текущими
+строками выполняются три пакетных запроса: DELETE лишних, UPDATE порядка
+только у сдвинувшихся и INSERT новых. id оставшихся изображений не меняются.
+"""
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import List, Union
+
+from fastapi import HTTPException
+from sqlalchemy import bindparam, delete, insert, update
+from sqlalchemy.orm import Session
+
+import models
+
+
+def current_images(db: Session, album_id: int) -> list:
+    return db.query(
+        models.AlbumImage.id,
+        models.AlbumImage.url,
+        models.AlbumImage.order
+    ).filter(
+        models.AlbumImage.album_id == album_id
+    ).order_by(models.AlbumImage.order, models.AlbumImage.id).all()
+
+
+def desired_from_urls(current: list, urls: List[str]) -> list:
+    """Полный список URL -> желаемое состояние, переиспользуя строки с теми же URL"""
+    by_url = defaultdict(deque)
+    for image in current:
+        by_url[image.url].append(image.id)
+    return [by_url[url].popleft() if by_url[url] else url for url in urls]
+
+
+def desired_from_patch(current: list, add: List[str], remove: List[int], order: List[int]) -> list:
+    """Операции PATCH -> желаемое состояние"""
+    current_ids = [image.id for image in current]
+    unknown = (set(remove) | set(order)) - set(current_ids)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Изображения не найдены в альбоме: {sorted(unknown)}")
+    removed = set(remove)
+    if removed & set(order):
+        raise HTTPException(status_code=400, detail="Нельзя одновременно удалить и переставить изображение")
+    # Перечисленные в order идут первыми, остальные сохраняют текущий порядок
+    ordered = set(order)
+    kept = list(order) + [image_id for image_id in current_ids if image_id not in ordered and image_id not in removed]
+    return kept + list(add)
+
+
+def apply_images(db: Session, album_id: int, current: list, desired: List[Union[int, str]]) -> dict:
+    """Применение разницы в текущей транзакции (commit делает вызывающий)"""
+    rows = {image.id: image for image in current}
+    kept_ids = [item for item in desired if isinstance(item, int)]
+    if len(kept_ids) != len(set(kept_ids)):
+        raise HTTPException(status_code=400, detail="Изображение указано несколько раз")
+    if set(kept_ids) - rows.keys():
+        raise HTTPException(status_code=400, detail="Изображение не принадлежит альбому")
+
+    kept = set(kept_ids)
+    deleted = [image_id for image_id in rows if image_id not in kept]
+    moved = [
+        {"b_id": item, "b_order": position}
+        for position, item in enumerate(desired)
+        if isinstance(item, int) and rows[item].order != position
+    ]
+    now = datetime.utcnow()
+    added = [
+        {"album_id": album_id, "url": item, "order": position, "created_at": now}
+        for position, item in enumerate(desired)
+        if isinstance(item, str)
+    ]
+
+    connection = db.connection()
+    if deleted:
+        connection.execute(delete(models.AlbumImage).where(models.AlbumImage.id.in_(deleted)))
+    if moved:
+        connection.execute(
+            update(models.AlbumImage)
+            .where(models.AlbumImage.id == bindparam("b_id"))
+            .values(order=bindparam("b_order")),
+            moved
+        )
+    if added:
+        connection.execute(insert(models.AlbumImage), added)
+
+    return {"added": len(added), "removed": len(deleted), "moved": len(moved)}
@@ -0,0 +1,474 @@
+"""Нагрузочный прогон на синтетических данных.
+
+Работает только с отдельной базой (DATABASE_PATH, по умолчанию bench.db во
+временном каталоге), рабочую sql_app.db не трогает:
+
+    python bench.py seed                     # создать и заполнить базу
+    python bench.py run [сценарий] [отчет]   # прогон, по умолчанию mixed -> bench.json
+    python bench.py serialization [отчет]    # CPU на запрос: быстрая сериализация против моделей
+
+Объемы данных (BENCH_USERS, BENCH_PROGRESS, BENCH_ALBUMS, BENCH_IMAGES,
+BENCH_VIDEOS) и генератор (BENCH_SEED) задаются переменными окружения, так
+что базу можно воспроизвести. Запросы идут в приложение в том же процессе
+(ASGI без сети): BENCH_REQUESTS запросов на сценарий в BENCH_CONCURRENCY
+параллельных потоках.
+
+Сценарии: login (всплеск входов), kurs (прогресс на странице курса),
+gallery (просмотр галереи), admin (админ-панель), mixed (смесь всех).
+В отчете для каждого маршрута - p50/p95/p99, пропускная способность и
+количество SQL-запросов на запрос; JSON удобно сравнивать между коммитами.
+
+serialization прогоняет маршруты каталога с быстрой сериализацией
+(fast_json.py) и без нее по BENCH_SERIALIZATION_REQUESTS раз, сбрасывая кеш
+каталога перед каждым запросом, и сообщает процессорное время на запрос,
+экономию и совпадение тел ответов.
+"""
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.gettempdir(), "bench.db"))
+
+import logging  # noqa: E402
+
+from sqlalchemy import insert  # noqa: E402
+
+import migrations  # noqa: E402
+import models  # noqa: E402
+import sql_metrics  # noqa: E402
+import stats  # noqa: E402
+from catalog_cache import catalog_cache  # noqa: E402
+from database import DATABASE_PATH, SessionLocal, engine  # noqa: E402
+from hashing import get_pwd_context  # noqa: E402
+from principals import principal_cache  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+USERS = int(os.getenv("BENCH_USERS", 50000))
+PROGRESS_ROWS = int(os.getenv("BENCH_PROGRESS", 600000))
+ALBUMS = int(os.getenv("BENCH_ALBUMS", 2000))
+IMAGES = int(os.getenv("BENCH_IMAGES", 100000))
+VIDEOS = int(os.getenv("BENCH_VIDEOS", 500))
+SEED = int(os.getenv("BENCH_SEED", 42))
+
+REQUESTS = int(os.getenv("BENCH_REQUESTS", 2000))
+SERIALIZATION_REQUESTS = int(os.getenv("BENCH_SERIALIZATION_REQUESTS", 100))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", 16))
+TOKEN_POOL = 200  # пользователей с заранее выданными токенами
+
+PASSWORD = "bench"
+ADMIN_USERNAME = "bench-admin"
+CHUNK = 10000
+ARTISTS = ["Artel", "Nova", "Kite", "Moss", "Orbit", "Vega", "Lumen", "Drift"]
+ALBUM_TYPES = ["Кампейн", "Каталог", "Промо к релизу"]
+VIDEO_TYPES = ["Муд-видео", "Сниппет", "Клип"]
+
+
+def _insert_chunks(connection, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == CHUNK:
+            connection.execute(insert(table), batch)
+            batch = []
+    if batch:
+        connection.execute(insert(table), batch)
+
+
+def seed():
+    if os.path.abspath(DATABASE_PATH) == os.path.abspath(os.path.join(BASE_DIR, "..", "sql_app.db")):
+        print("Заполнять можно только отдельную базу, задайте DATABASE_PATH")
+        sys.exit(1)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(DATABASE_PATH + suffix):
+            os.remove(DATABASE_PATH + suffix)
+    models.Base.metadata.create_all(bind=engine)
+    migrations.upgrade(engine)
+
+    rng = random.Random(SEED)
+    # Один хеш на всех: bcrypt для 50k пользователей занял бы часы
+    hashed_password = get_pwd_context().hash(PASSWORD)
+    started = time.perf_counter()
+    registered = datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        _insert_chunks(connection, models.User.__table__, (
+            {
+                "id": user_id,
+                "username": ADMIN_USERNAME if user_id == 1 else f"user{user_id:06d}",
+                "first_name": f"Имя{user_id}",
+                "last_name": f"Фамилия{user_id}",
+                "hashed_password": hashed_password,
+                "is_admin": 1 if user_id == 1 or rng.random() < 0.01 else 0,
+                "date_reg": (registered + timedelta(days=rng.randrange(700))).strftime("%d.%m.%Y"),
+            }
+            for user_id in range(1, USERS + 1)
+        ))
+
+        slots = USERS * stats.TOTAL_LESSONS
+        chosen = sorted(rng.sample(range(slots), min(PROGRESS_ROWS, slots)))
+        _insert_chunks(connection, models.UserProgress.__table__, (
+            {
+                "user_id": slot // stats.TOTAL_LESSONS + 1,
+                "lesson_id": slot % stats.TOTAL_LESSONS + 1,
+                "is_completed": 1 if rng.random() < 0.8 else 0,
+            }
+            for slot in chosen
+        ))
+
+        _insert_chunks(connection, models.Video.__table__, (
+            {
+                "title": f"Видео {i}",
+                "artist": rng.choice(ARTISTS),
+                "type": rng.choice(VIDEO_TYPES),
+                "youtube_url": f"https://www.youtube.com/watch?v=bench{i:05d}",
+                "thumbnail_url": f"/assets/thumbnails/bench{i}.jpg",
+                "order": i,
+                "created_at": registered,
+            }
+            for i in range(VIDEOS)
+        ))
+
+        _insert_chunks(connection, models.PhotoAlbum.__table__, (
+            {
+                "id": album_id,
+                "title": f"Альбом {album_id}",
+                "artist": rng.choice(ARTISTS),
+                "type": rng.choice(ALBUM_TYPES),
+                "preview_url": f"/assets/previews/bench{album_id}.jpg",
+                "order": album_id,
+                "created_at": registered,
+            }
+            for album_id in range(1, ALBUMS + 1)
+        ))
+        per_album = [0] * (ALBUMS + 1)
+        images = []
+        for n in range(IMAGES):
+            album_id = rng.randrange(1, ALBUMS + 1) if ALBUMS else None
+            if album_id is None:
+                break
+            images.append({
+                "album_id": album_id,
+                "url": f"/assets/images/bench{n}.jpg",
+                "order": per_album[album_id],
+                "created_at": registered,
+            })
+            per_album[album_id] += 1
+        _insert_chunks(connection, models.AlbumImage.__table__, images)
+
+    db = SessionLocal()
+    try:
+        stats.rebuild_stats(db)
+    finally:
+        db.close()
+    with sqlite3.connect(DATABASE_PATH) as connection:
+        connection.execute("ANALYZE")
+    # Запущенный на этой базе сервер не должен отдавать каталог и пользователей
+    # из старой: оба кеша сбрасываются через свои файлы версий
+    catalog_cache.bump()
+    principal_cache.invalidate()
+    logger.info(
+        f"База {DATABASE_PATH} заполнена за {time.perf_counter() - started:.1f} с: "
+        f"{USERS} пользователей, {len(chosen)} строк прогресса, {ALBUMS} альбомов, "
+        f"{len(images)} изображений, {VIDEOS} видео"
+    )
+
+
+# --- Сценарии: функция получает клиента и генератор и выполняет один запрос ---
+class Traffic:
+    def __init__(self, client, rng: random.Random, tokens: list, admin_headers: dict):
+        self.client = client
+        self.rng = rng
+        self.tokens = tokens
+        self.admin_headers = admin_headers
+        self.samples = {}
+
+    async def request(self, route: str, method: str, url: str, **kwargs):
+        with sql_metrics.track() as queries:
+            started = time.perf_counter()
+            response = await self.client.request(method, url, **kwargs)
+            elapsed = time.perf_counter() - started
+        self.samples.setdefault(route, []).append(
+            (elapsed, queries.count, queries.seconds, response.status_code >= 400, len(response.content))
+        )
+        return response
+
+    def student(self) -> dict:
+        return {"Authorization": f"Bearer {self.rng.choice(self.tokens)}"}
+
+    async def login(self):
+        user_id = self.rng.randrange(2, USERS + 1)
+        await self.request("POST /token", "POST", "/token", data={"username": f"user{user_id:06d}", "password": PASSWORD})
+
+    async def kurs(self):
+        headers = self.student()
+        action = self.rng.random()
+        if action < 0.6:
+            # Открытие Kurs.html: пользователь и прогресс одним запросом
+            await self.request("GET /bootstrap/kurs/", "GET", "/bootstrap/kurs/", headers=headers)
+        elif action < 0.8:
+            lesson_id = self.rng.randrange(1, stats.TOTAL_LESSONS + 1)
+            await self.request("POST /progress/", "POST", "/progress/", headers=headers,
+                               json={"lesson_id": lesson_id, "is_completed": self.rng.random() < 0.7})
+        else:
+            lessons = self.rng.sample(range(1, stats.TOTAL_LESSONS + 1), self.rng.randrange(2, 6))
+            items = [{"lesson_id": lesson_id, "is_completed": self.rng.random() < 0.7} for lesson_id in lessons]
+            await self.request("POST /progress/batch", "POST", "/progress/batch", headers=headers, json={"items": items})
+
+    async def gallery(self):
+        action = self.rng.random()
+        if action < 0.55:
+            # Открытие Portfolio-photo.html (первая страница и количество),
+            # затем листание галереи по курсору
+            response = await self.request(
+                "GET /bootstrap/portfolio-photo/", "GET", "/bootstrap/portfolio-photo/?limit=12"
+            )
+            cursor = response.json().get("next_cursor")
+            for _ in range(self.rng.randrange(0, 3)):
+                if not cursor:
+                    break
+                response = await self.request(
+                    "GET /photo-albums/", "GET", f"/photo-albums/?view=summary&limit=12&cursor={cursor}"
+                )
+                cursor = response.headers.get("X-Next-Cursor")
+        elif action < 0.85:
+            album_id = self.rng.randrange(1, ALBUMS + 1)
+            await self.request("GET /photo-albums/{album_id}", "GET", f"/photo-albums/{album_id}")
+        else:
+            await self.request("GET /videos/", "GET", "/videos/")
+
+    async def admin(self):
+        action = self.rng.random()
+        if action < 0.3:
+            await self.request("GET /admin/stats/", "GET", "/admin/stats/", headers=self.admin_headers)
+        elif action < 0.8:
+            url = "/admin/users/?limit=50"
+            for _ in range(self.rng.randrange(1, 4)):
+                response = await self.request("GET /admin/users/", "GET", url, headers=self.admin_headers)
+                cursor = response.json().get("next_cursor")
+                if not cursor:
+                    break
+                url = f"/admin/users/?limit=50&cursor={cursor}"
+        else:
+            await self.request("GET /admin/users/ (sort=progress)", "GET",
+                               "/admin/users/?limit=50&sort=progress&order=desc", headers=self.admin_headers)
+
+
+MIXES = {
+    "login": {"login": 1},
+    "kurs": {"kurs": 1},
+    "gallery": {"gallery": 1},
+    "admin": {"admin": 1},
+    "mixed": {"kurs": 50, "gallery": 35, "login": 10, "admin": 5},
+}
+
+
+def _percentile(sorted_values: list, percent: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def _summary(samples: list, duration: float) -> dict:
+    latencies = sorted(sample[0] for sample in samples)
+    queries = [sample[1] for sample in samples]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for sample in samples if sample[3]),
+        "throughput_rps": round(len(samples) / duration, 1) if duration else 0,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50) * 1000, 2),
+            "p95": round(_percentile(latencies, 95) * 1000, 2),
+            "p99": round(_percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0,
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0,
+        },
+        "sql_per_request": {
+            "mean": round(sum(queries) / len(queries), 2) if queries else 0,
+            "max": max(queries, default=0),
+        },
+        "sql_ms_per_request": round(sum(sample[2] for sample in samples) / len(samples) * 1000, 3) if samples else 0,
+        "response_bytes_mean": round(sum(sample[4] for sample in samples) / len(samples)) if samples else 0,
+    }
+
+
+async def run_mix(app, mix: str, tokens: list, admin_headers: dict) -> dict:
+    import httpx
+
+    rng = random.Random(SEED)
+    weights = MIXES[mix]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        traffic = Traffic(client, rng, tokens, admin_headers)
+        scenarios = [getattr(traffic, name) for name in weights]
+        plan = rng.choices(scenarios, weights=list(weights.values()), k=REQUESTS)
+        queue = iter(plan)
+
+        async def worker():
+            for scenario in queue:
+                await scenario()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+        duration = time.perf_counter() - started
+
+    all_samples = [sample for samples in traffic.samples.values() for sample in samples]
+    return {
+        "duration_s": round(duration, 2),
+        **_summary(all_samples, duration),
+        "routes": {route: _summary(samples, duration) for route, samples in sorted(traffic.samples.items())},
+    }
+
+
+# Маршруты с быстрым путем сериализации
+SERIALIZATION_ROUTES = {
+    "GET /videos/": "/videos/",
+    "GET /photo-albums/ (full)": "/photo-albums/?limit=100",
+    "GET /photo-albums/ (summary)": "/photo-albums/?limit=100&view=summary",
+    "GET /photo-albums/{album_id}": "/photo-albums/1",
+}
+
+
+async def measure_serialization(app) -> dict:
+    import httpx
+
+    import fast_json
+    from catalog_cache import catalog_cache
+
+    async def measure(client, url: str) -> tuple:
+        cpu = wall = 0.0
+        body = b""
+        for _ in range(SERIALIZATION_REQUESTS):
+            # Без сброса ответ пришел бы из кеша каталога и не сериализовался
+            catalog_cache.bump()
+            started_cpu, started = time.process_time(), time.perf_counter()
+            response = await client.get(url)
+            cpu += time.process_time() - started_cpu
+            wall += time.perf_counter() - started
+            body = response.content
+        return cpu / SERIALIZATION_REQUESTS, wall / SERIALIZATION_REQUESTS, body
+
+    enabled = fast_json.ENABLED
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for route, url in SERIALIZATION_ROUTES.items():
+                measured = {}
+                for mode, fast in (("validated", False), ("fast", True)):
+                    fast_json.ENABLED = fast
+                    await client.get(url)  # прогрев
+                    measured[mode] = await measure(client, url)
+                (slow_cpu, slow_wall, slow_body), (fast_cpu, fast_wall, fast_body) = measured["validated"], measured["fast"]
+                results[route] = {
+                    "validated": {"cpu_ms": round(slow_cpu * 1000, 3), "wall_ms": round(slow_wall * 1000, 3)},
+                    "fast": {"cpu_ms": round(fast_cpu * 1000, 3), "wall_ms": round(fast_wall * 1000, 3)},
+                    "cpu_saved_ms": round((slow_cpu - fast_cpu) * 1000, 3),
+                    "cpu_saved_percent": round((1 - fast_cpu / slow_cpu) * 100, 1) if slow_cpu else 0,
+                    "response_bytes": len(fast_body),
+                    "identical_body": slow_body == fast_body,
+                }
+    finally:
+        fast_json.ENABLED = enabled
+    return results
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(mix: str, output: str):
+    if not os.path.exists(DATABASE_PATH):
+        print("База не найдена, сначала выполните: python bench.py seed")
+        sys.exit(1)
+    import main
+
+    db = SessionLocal()
+    try:
+        student_ids = [
+            user_id for (user_id,) in db.query(models.User.id).filter(models.User.is_admin == 0)
+            .order_by(models.User.id).limit(TOKEN_POOL)
+        ]
+    finally:
+        db.close()
+    tokens = [main.create_access_token({"sub": f"user{user_id:06d}"}, timedelta(hours=1)) for user_id in student_ids]
+    admin_headers = {"Authorization": f"Bearer {main.create_access_token({'sub': ADMIN_USERNAME}, timedelta(hours=1))}"}
+
+    report = {
+        "commit": _git_commit(),
+        "started_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "database": DATABASE_PATH,
+        "requests": REQUESTS,
+        "concurrency": CONCURRENCY,
+        "mixes": {},
+    }
+    mixes = list(MIXES) if mix == "all" else [mix]
+    for name in mixes:
+        logger.info(f"Сценарий {name}: {REQUESTS} запросов, параллельно {CONCURRENCY}")
+        result = asyncio.run(run_mix(main.app, name, tokens, admin_headers))
+        report["mixes"][name] = result
+        logger.info(
+            f"{name}: {result['throughput_rps']} запросов/с, p50 {result['latency_ms']['p50']} мс, "
+            f"p99 {result['latency_ms']['p99']} мс, SQL на запрос {result['sql_per_request']['mean']}"
+        )
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    logger.info(f"Отчет сохранен: {output}")
+
+
+def run_serialization(output: str):
+    if not os.path.exists(DATABASE_PATH):
+        print("База не найдена, сначала выполните: python bench.py seed")
+        sys.exit(1)
+    import fast_json
+    import main
+
+    routes = asyncio.run(measure_serialization(main.app))
+    report = {
+        "commit": _git_commit(),
+        "started_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "encoder": "orjson" if fast_json.orjson is not None else "json",
+        "database": DATABASE_PATH,
+        "requests": SERIALIZATION_REQUESTS,
+        "routes": routes,
+    }
+    for route, result in routes.items():
+        logger.info(
+            f"{route}: CPU {result['validated']['cpu_ms']} -> {result['fast']['cpu_ms']} мс на запрос "
+            f"(-{result['cpu_saved_percent']}%), тела {'совпадают' if result['identical_body'] else 'РАЗЛИЧАЮТСЯ'}"
+        )
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    logger.info(f"Отчет сохранен: {output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    command = sys.argv[1:2]
+    if command == ["seed"]:
+        seed()
+    elif command == ["run"] and (len(sys.argv) < 3 or sys.argv[2] in MIXES or sys.argv[2] == "all"):
+        run(sys.argv[2] if len(sys.argv) > 2 else "mixed", sys.argv[3] if len(sys.argv) > 3 else "bench.json")
+    elif command == ["serialization"]:
+        run_serialization(sys.argv[2] if len(sys.argv) > 2 else "bench-serialization.json")
+    else:
+        print(f"Использование: python bench.py seed | run [{'|'.join(MIXES)}|all] [отчет.json] | serialization [отчет.json]")
+        sys.exit(1)
@@ -0,0 +1,251 @@
+"""Хранилище загруженных файлов по хешу содержимого.
+
+Файл с SHA-256 abcd... лежит в static/uploads/blobs/ab/cd/abcd...<расширение>,
+рядом - его адаптивные варианты (abcd....640w.webp). Одинаковые загрузки
+хранятся один раз.
+
+Для каждого файла в таблице blobs ведется счетчик ссылок из
+PhotoAlbum.preview_url, AlbumImage.url и Video.thumbnail_url. Счетчик меняют
+триггеры на INSERT, DELETE и UPDATE этих столбцов - в той же транзакции, что
+и ссылка, при любом способе записи (видео наполняются в обход API).
+Триггеры и пересчет для существующей базы - шаг migrations.py.
+
+Файлы без ссылок дольше BLOB_GC_GRACE_SECONDS удаляет сборщик мусора
+порциями по BLOB_GC_BATCH_SIZE. Повторное использование уже лежащего файла
+при загрузке (store_file) и удаление файлов сборщиком идут под одной
+межпроцессной блокировкой (flock), поэтому сборщик не удалит файл, который
+только что отдан загрузке как дубликат:
+
+    python blobs.py gc            # один проход сборщика
+    python blobs.py rebuild-refs  # пересчет счетчиков по таблицам
+"""
+import fcntl
+import glob
+import logging
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import IO, Optional
+
+from sqlalchemy import case, delete, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BLOB_ROOT = os.path.join(BASE_DIR, "static", "uploads", "blobs")
+BLOB_URL_PREFIX = "/static/uploads/blobs"
+TEMP_DIR = os.path.join(BLOB_ROOT, ".tmp")
+LOCK_PATH = os.path.join(BLOB_ROOT, ".lock")
+GC_LOCK_PATH = os.path.join(BLOB_ROOT, ".gc.lock")
+
+GC_GRACE_SECONDS = int(os.getenv("BLOB_GC_GRACE_SECONDS", 24 * 3600))
+GC_BATCH_SIZE = int(os.getenv("BLOB_GC_BATCH_SIZE", 100))
+
+# Таблица -> столбец со ссылкой на файл
+REFERENCES = {
+    "photo_albums": "preview_url",
+    "album_images": "url",
+    "video": "thumbnail_url",
+}
+
+
+def _relative_path(sha256: str, extension: str) -> str:
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+def blob_path(sha256: str, extension: str) -> str:
+    return os.path.join(BLOB_ROOT, *_relative_path(sha256, extension).split("/"))
+
+
+def blob_url(sha256: str, extension: str) -> str:
+    return f"{BLOB_URL_PREFIX}/{_relative_path(sha256, extension)}"
+
+
+def _sha256_sql(column: str) -> str:
+    """SQL: хеш файла из URL хранилища (/static/uploads/blobs/ab/cd/<sha256>.ext)"""
+    return f"substr({column}, {len(BLOB_URL_PREFIX) + 8}, 64)"
+
+
+def _is_blob_url_sql(column: str) -> str:
+    return f"{column} GLOB '{BLOB_URL_PREFIX}/[0-9a-f][0-9a-f]/[0-9a-f][0-9a-f]/*'"
+
+
+def _trigger_ddl(table: str, column: str) -> list:
+    def increment(url: str) -> str:
+        return f"""
+        UPDATE blobs SET ref_count = ref_count + 1, unreferenced_since = NULL
+        WHERE {_is_blob_url_sql(url)} AND sha256 = {_sha256_sql(url)};"""
+
+    def decrement(url: str) -> str:
+        # Последняя ссылка снята - с этого момента идет льготный период сборщика
+        return f"""
+        UPDATE blobs SET ref_count = ref_count - 1,
+            unreferenced_since = CASE WHEN ref_count = 1 THEN datetime('now') ELSE unreferenced_since END
+        WHERE {_is_blob_url_sql(url)} AND sha256 = {_sha256_sql(url)};"""
+
+    name = f"blob_refs_{table}"
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {table}
+            WHEN new.{column} IS NOT NULL BEGIN{increment(f"new.{column}")}\nEND""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {table}
+            WHEN old.{column} IS NOT NULL BEGIN{decrement(f"old.{column}")}\nEND""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE OF {column} ON {table}
+            WHEN old.{column} IS NOT new.{column} BEGIN{decrement(f"old.{column}")}{increment(f"new.{column}")}\nEND""",
+    ]
+
+
+def create_triggers(connection: Connection):
+    """Триггеры счетчиков ссылок и их пересчет, если триггеров еще нет (шаг миграции)"""
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'blob_refs_video_ai'")
+    ).first() is not None
+    if exists:
+        return
+    for table, column in REFERENCES.items():
+        for statement in _trigger_ddl(table, column):
+            connection.execute(text(statement))
+    # До триггеров ссылки из видео не учитывались
+    rebuild_refs(connection)
+
+
+@contextmanager
+def _store_lock():
+    """Межпроцессная блокировка хранилища (все воркеры и python blobs.py gc)"""
+    os.makedirs(BLOB_ROOT, exist_ok=True)
+    with open(LOCK_PATH, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def acquire_gc_lock() -> Optional[IO]:
+    """Неблокирующий захват роли сборщика мусора среди воркеров.
+
+    Блокировка держится, пока открыт возвращенный файл (до выхода процесса);
+    None - сборщик уже работает в другом процессе.
+    """
+    os.makedirs(BLOB_ROOT, exist_ok=True)
+    lock_file = open(GC_LOCK_PATH, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def store_file(db: Session, temp_path: str, sha256: str, extension: str, size: int, content_type: str) -> tuple:
+    """Перенос временного файла в хранилище и запись о нем (с коммитом); (путь, был ли уже такой файл).
+
+    Выполняется в пуле потоков: ждет блокировку хранилища.
+    """
+    path = blob_path(sha256, extension)
+    with _store_lock():
+        # Под блокировкой сборщик не может удалить файл между проверкой и
+        # register(), а после register() льготный период начинается заново
+        deduplicated = os.path.exists(path)
+        if deduplicated:
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        register(db, sha256, extension, size, content_type)
+        db.commit()
+    return path, deduplicated
+
+
+def register(db: Session, sha256: str, extension: str, size: int, content_type: str):
+    """Запись о файле; повторная загрузка продлевает льготный период сборщика"""
+    now = datetime.utcnow()
+    stmt = insert(models.Blob).values(
+        sha256=sha256,
+        extension=extension,
+        size=size,
+        content_type=content_type,
+        ref_count=0,
+        unreferenced_since=now,
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[models.Blob.sha256],
+        set_={"unreferenced_since": case(
+            (models.Blob.ref_count <= 0, now),
+            else_=models.Blob.unreferenced_since
+        )}
+    ))
+
+
+def rebuild_refs(connection: Connection):
+    """Пересчет счетчиков ссылок по таблицам"""
+    urls = " UNION ALL ".join(f"SELECT {column} AS url FROM {table}" for table, column in REFERENCES.items())
+    connection.execute(text("UPDATE blobs SET ref_count = 0"))
+    connection.execute(text(f"""
+        UPDATE blobs SET ref_count = refs.count
+        FROM (
+            SELECT {_sha256_sql("url")} AS sha256, COUNT(*) AS count FROM ({urls})
+            WHERE {_is_blob_url_sql("url")} GROUP BY 1
+        ) AS refs
+        WHERE refs.sha256 = blobs.sha256
+    """))
+    connection.execute(text("""
+        UPDATE blobs SET unreferenced_since = CASE
+            WHEN ref_count > 0 THEN NULL ELSE COALESCE(unreferenced_since, datetime('now'))
+        END
+    """))
+
+
+def collect_garbage(db: Session, grace_seconds: int = GC_GRACE_SECONDS, batch_size: int = GC_BATCH_SIZE) -> int:
+    """Один проход сборщика: удаляет не больше batch_size файлов без ссылок"""
+    deadline = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    orphaned = models.Blob.ref_count <= 0, models.Blob.unreferenced_since < deadline
+    candidates = db.query(models.Blob.sha256, models.Blob.extension).filter(*orphaned).limit(batch_size).all()
+
+    removed = []
+    with _store_lock():
+        for sha256, extension in candidates:
+            # Условие повторяется: ссылка или повторная загрузка могли появиться после выборки
+            result = db.execute(delete(models.Blob).where(models.Blob.sha256 == sha256, *orphaned))
+            if result.rowcount:
+                removed.append((sha256, extension))
+        db.commit()
+
+        # Файлы удаляются только после фиксации транзакции
+        for sha256, extension in removed:
+            pattern = os.path.join(os.path.dirname(blob_path(sha256, extension)), f"{sha256}.*")
+            for path in glob.glob(pattern):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+    if removed:
+        logger.info(f"Сборщик мусора удалил файлов: {len(removed)}")
+    return len(candidates)
+
+
+if __name__ == "__main__":
+    import sys
+    from database import SessionLocal, engine
+
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1:2]
+    if command not in (["gc"], ["rebuild-refs"]):
+        print("Использование: python blobs.py gc | rebuild-refs")
+        sys.exit(1)
+    models.Base.metadata.create_all(bind=engine)
+    if command == ["rebuild-refs"]:
+        with engine.begin() as connection:
+            rebuild_refs(connection)
+        print("Счетчики ссылок пересчитаны")
+        sys.exit(0)
+    session = SessionLocal()
+    try:
+        while collect_garbage(session) == GC_BATCH_SIZE:
+            pass
+    finally:
+        session.close()
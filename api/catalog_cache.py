@@ -0,0 +1,176 @@
+"""Кеш публичных ответов каталога (видео и фотоальбомы).
+
+Ответы хранятся уже сериализованными вместе с ETag. Любое изменение
+каталога вызывает bump(): версия увеличивается и все ответы сбрасываются.
+Ключи включают параметры анонимных запросов (курсор, фильтры), поэтому кеш
+ограничен (LRU): не больше CATALOG_CACHE_SIZE ответов и CATALOG_CACHE_MAX_BYTES
+байт тел.
+Версия дублируется в файл рядом с БД (version_file.py), поэтому сброс видят
+и другие воркеры.
+
+Видео наполняются в обход API, поэтому bump() вызывают не все изменения.
+Триггеры на INSERT, UPDATE и DELETE таблиц каталога (шаг migrations.py)
+увеличивают счетчик в catalog_version, а каждый воркер раз в
+CATALOG_VERSION_CHECK_SECONDS сверяет его в фоновой задаче
+(watch_catalog_version) и при изменении сбрасывает кеш. Запросы к API
+дополнительных SQL-запросов не делают.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, NamedTuple, Optional, Tuple, Union
+
+from fastapi import Request, Response
+from sqlalchemy import select, text
+from sqlalchemy.engine import Connection
+
+import compression
+import models
+from database import DATABASE_PATH, async_engine
+from version_file import VersionFile
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", 512))
+CATALOG_CACHE_MAX_BYTES = int(os.getenv("CATALOG_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+CATALOG_VERSION_CHECK_SECONDS = float(os.getenv("CATALOG_VERSION_CHECK_SECONDS", 2))
+
+# Таблицы, изменение которых меняет ответы каталога
+CATALOG_TABLES = ("video", "photo_albums", "album_images")
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    headers: dict
+
+
+class CatalogCache:
+    def __init__(self, version_file: str, max_size: int, max_bytes: int):
+        self.version_file = VersionFile(version_file)
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.version = 0
+        self.data_version = None  # последнее увиденное значение catalog_version
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _clear(self):
+        self.version += 1
+        self._entries.clear()
+        self._bytes = 0
+
+    def get(self, key) -> Optional[CachedResponse]:
+        with self._lock:
+            # Сброс, сделанный другим процессом
+            if self.version_file.changed():
+                self._clear()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body: bytes, version: int, headers: Optional[dict] = None) -> CachedResponse:
+        entry = CachedResponse(
+            body=body,
+            etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+            headers=headers or {}
+        )
+        with self._lock:
+            # Данные, прочитанные до bump(), и тела больше всего кеша не сохраняем
+            if version != self.version or len(body) > self.max_bytes:
+                return entry
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            self._entries[key] = entry
+            self._bytes += len(body)
+            while len(self._entries) > self.max_size or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+        return entry
+
+    def bump(self):
+        with self._lock:
+            self._clear()
+            self.version_file.touch()
+
+    def sync_data_version(self, data_version: int):
+        """Сброс, если каталог изменился в базе (в том числе в обход API)"""
+        with self._lock:
+            if self.data_version is not None and data_version != self.data_version:
+                self._clear()
+            self.data_version = data_version
+
+
+catalog_cache = CatalogCache(
+    os.getenv("CATALOG_VERSION_FILE", f"{DATABASE_PATH}.catalog-version"),
+    max_size=CATALOG_CACHE_SIZE,
+    max_bytes=CATALOG_CACHE_MAX_BYTES,
+)
+
+
+def create_triggers(connection: Connection):
+    """Строка catalog_version и триггеры на таблицы каталога (шаг миграции)"""
+    connection.execute(text("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)"))
+    for table in CATALOG_TABLES:
+        for suffix, event in (("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE")):
+            connection.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS catalog_version_{table}_{suffix} AFTER {event} ON {table} BEGIN
+                    UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+                END"""))
+
+
+async def watch_catalog_version():
+    """Фоновая задача воркера: сброс кеша при изменении catalog_version"""
+    while True:
+        try:
+            async with async_engine.connect() as connection:
+                data_version = await connection.scalar(
+                    select(models.CatalogVersion.version).where(models.CatalogVersion.id == 1)
+                )
+            catalog_cache.sync_data_version(data_version or 0)
+        except Exception as e:
+            logger.error(f"Не удалось проверить версию каталога: {str(e)}")
+        await asyncio.sleep(CATALOG_VERSION_CHECK_SECONDS)
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Слабое сравнение (RFC 9110): сжатый ответ уходит с W/"..." (см. compression.py)
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+async def cached_response(
+    request: Request,
+    key,
+    build: Callable[[], Awaitable[Union[bytes, Tuple[bytes, dict]]]]
+) -> Response:
+    """Ответ из кеша (или 304), при промахе тело строится через build().
+
+    build() возвращает тело или пару (тело, дополнительные заголовки).
+    """
+    entry = catalog_cache.get(key)
+    if entry is None:
+        version = catalog_cache.version
+        result = await build()
+        body, extra_headers = result if isinstance(result, tuple) else (result, None)
+        entry = catalog_cache.put(key, body, version, extra_headers)
+
+    headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request, entry.etag):
+        # 304 без тела CompressionMiddleware пропускает как есть: ETag и Vary
+        # должны совпасть с теми, что получил бы сжатый ответ 200
+        headers.update(compression.validator_headers(
+            request.headers.get("accept-encoding", ""), "application/json", len(entry.body), entry.etag
+        ))
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
@@ -0,0 +1,218 @@
+"""Сжатие динамических ответов (Brotli или gzip) на лету.
+
+CompressionMiddleware (чистый ASGI) выбирает кодировку по Accept-Encoding
+(br, если установлен модуль brotli, иначе gzip) и сжимает тело по мере
+отправки: ответ целиком не буферизуется, каждая часть потокового ответа
+сжимается и сбрасывается клиенту сразу. Задерживаются только первые части,
+пока их меньше COMPRESSION_MIN_SIZE байт (BaseHTTPMiddleware, например
+catch_exceptions_middleware, отдает любое тело частями, поэтому размер
+ответа заранее неизвестен). Не сжимаются:
+- уже сжатые ответы (есть Content-Encoding, например предсжатая статика);
+- типы, кроме текстовых (text/*, JSON, JS, XML, SVG): изображения, видео,
+  архивы и шрифты woff2 сжаты сами по себе;
+- тела меньше COMPRESSION_MIN_SIZE байт, HEAD, 204/304 и Range-ответы.
+
+ETag сжатого ответа становится слабым (W/"..."), поэтому If-None-Match
+сравнивается слабо (catalog_cache, StaticFiles). Ответ 304 без тела проходит
+без изменений: приложение, отвечающее 304 само, берет ETag и Vary из
+validator_headers().
+
+Настройки через переменные окружения:
+    COMPRESSION_MIN_SIZE       - минимальный размер тела (по умолчанию 1024)
+    COMPRESSION_GZIP_LEVEL     - уровень gzip 1-9 (по умолчанию 6)
+    COMPRESSION_BROTLI_QUALITY - качество Brotli 0-11 (по умолчанию 4: для
+                                 динамики дешевле gzip -6 при лучшем сжатии)
+"""
+import os
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from static_assets import accepted_encodings
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli не установлен, будет только gzip
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4))
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+}
+
+
+def is_compressible(content_type: str) -> bool:
+    media_type = content_type.partition(";")[0].strip().lower()
+    return (
+        media_type.startswith("text/")
+        or media_type in COMPRESSIBLE_TYPES
+        or media_type.endswith(("+json", "+xml"))
+    )
+
+
+def negotiate(accept_encoding: str) -> str:
+    """Кодировка ответа по Accept-Encoding: br, gzip или "" (без сжатия)"""
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return ""
+
+
+def validator_headers(accept_encoding: str, content_type: str, size: int, etag: str) -> dict:
+    """ETag и Vary, с которыми ушел бы ответ 200 с телом size байт (для 304)"""
+    if not negotiate(accept_encoding) or not is_compressible(content_type):
+        return {"ETag": etag}
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if size >= COMPRESSION_MIN_SIZE and not etag.startswith("W/"):
+        headers["ETag"] = f"W/{etag}"
+    return headers
+
+
+class GzipCompressor:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 - формат gzip
+
+    def process(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def process(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app,
+        minimum_size: int = COMPRESSION_MIN_SIZE,
+        gzip_level: int = COMPRESSION_GZIP_LEVEL,
+        brotli_quality: int = COMPRESSION_BROTLI_QUALITY,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _compressor(self, encoding: str):
+        if encoding == "br":
+            return BrotliCompressor(self.brotli_quality)
+        return GzipCompressor(self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start = None  # http.response.start, задержанный до решения о сжатии
+        pending = []  # первые части тела, пока их меньше minimum_size
+        pending_size = 0
+        compressor = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, compressor, passthrough, pending_size
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message.get("headers", []))
+                content_length = headers.get("content-length")
+                if (
+                    message["status"] in (204, 206, 304)
+                    or "content-encoding" in headers
+                    or "content-range" in headers
+                    or not is_compressible(headers.get("content-type", ""))
+                ):
+                    passthrough = True
+                    await send(message)
+                    return
+                if content_length is not None and int(content_length) < self.minimum_size:
+                    # Не сжимается из-за размера, но ответ зависит от Accept-Encoding
+                    MutableHeaders(scope=message).add_vary_header("Accept-Encoding")
+                    passthrough = True
+                    await send(message)
+                    return
+                start = message
+                return
+
+            if message["type"] != "http.response.body" or start is None:
+                # Другие расширения ASGI (pathsend и т.п.) - без сжатия
+                passthrough = True
+                if start is not None:
+                    await send(start)
+                    if pending:
+                        await send({"type": "http.response.body", "body": b"".join(pending), "more_body": True})
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                pending.append(body)
+                pending_size += len(body)
+                if more_body and pending_size < self.minimum_size:
+                    return
+                body = b"".join(pending)
+                pending.clear()
+
+                headers = MutableHeaders(scope=start)
+                headers.add_vary_header("Accept-Encoding")
+                if pending_size < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+
+                compressor = self._compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = f"W/{etag}"
+                if more_body:
+                    del headers["Content-Length"]
+                    await send(start)
+                else:
+                    # Тело пришло целиком: длина известна заранее
+                    body = compressor.process(body) + compressor.finish()
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+
+            if more_body:
+                chunk = compressor.process(body) + compressor.flush()
+            else:
+                chunk = compressor.process(body) + compressor.finish()
+            if chunk or not more_body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
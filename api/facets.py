@@ -0,0 +1,93 @@
+"""Количество видео и фотоальбомов по типу (вкладки каталога).
+
+Счетчики хранятся в catalog_facets и меняются триггерами на INSERT, DELETE
+и UPDATE OF type таблиц video и photo_albums - в той же транзакции, что и
+запись, в том числе для видео, которые наполняются в обход API. Поэтому
+/catalog/facets/ читает несколько готовых строк вместо GROUP BY по каталогу.
+
+Триггеры и первичное заполнение - шаг migrations.py. Если счетчики
+разошлись с данными (например, после восстановления таблицы из копии):
+
+    python facets.py rebuild
+"""
+from sqlalchemy import select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+
+# Вид в catalog_facets -> таблица
+SOURCES = {
+    "video": "video",
+    "album": "photo_albums",
+}
+
+
+def _trigger_ddl(kind: str, source: str) -> list:
+    increment = f"""
+        INSERT INTO catalog_facets (kind, type, count) VALUES ('{kind}', new.type, 1)
+        ON CONFLICT (kind, type) DO UPDATE SET count = count + 1;"""
+    decrement = f"""
+        UPDATE catalog_facets SET count = count - 1 WHERE kind = '{kind}' AND type = old.type;"""
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS catalog_facets_{kind}_ai AFTER INSERT ON {source} BEGIN{increment}\nEND",
+        f"CREATE TRIGGER IF NOT EXISTS catalog_facets_{kind}_ad AFTER DELETE ON {source} BEGIN{decrement}\nEND",
+        f"""CREATE TRIGGER IF NOT EXISTS catalog_facets_{kind}_au AFTER UPDATE OF type ON {source}
+            WHEN old.type IS NOT new.type BEGIN{decrement}{increment}\nEND""",
+    ]
+
+
+def _rebuild(connection: Connection):
+    connection.execute(text("DELETE FROM catalog_facets"))
+    for kind, source in SOURCES.items():
+        connection.execute(text(
+            f"INSERT INTO catalog_facets (kind, type, count) "
+            f"SELECT '{kind}', type, COUNT(*) FROM {source} WHERE type IS NOT NULL GROUP BY type"
+        ))
+
+
+def create_triggers(connection: Connection):
+    """Триггеры и заполнение счетчиков, если триггеров еще нет (шаг миграции)"""
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'catalog_facets_album_ai'")
+    ).first() is not None
+    if exists:
+        return
+    for kind, source in SOURCES.items():
+        for statement in _trigger_ddl(kind, source):
+            connection.execute(text(statement))
+    _rebuild(connection)
+
+
+async def read_facets(db: AsyncSession) -> dict:
+    """{"video": [{"type": ..., "count": ...}], "album": [...]} по убыванию количества"""
+    result = await db.execute(
+        select(models.CatalogFacet.kind, models.CatalogFacet.type, models.CatalogFacet.count)
+        .where(models.CatalogFacet.count > 0)
+    )
+    facets = {kind: [] for kind in SOURCES}
+    for kind, type_, count in result:
+        facets.setdefault(kind, []).append({"type": type_, "count": count})
+    for items in facets.values():
+        items.sort(key=lambda item: (-item["count"], item["type"]))
+    return facets
+
+
+async def count(db: AsyncSession, kind: str, type_: str) -> int:
+    return await db.scalar(
+        select(models.CatalogFacet.count)
+        .where(models.CatalogFacet.kind == kind, models.CatalogFacet.type == type_)
+    ) or 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    from database import engine
+
+    if sys.argv[1:] != ["rebuild"]:
+        print("Использование: python facets.py rebuild")
+        sys.exit(1)
+    with engine.begin() as connection:
+        _rebuild(connection)
+    print("Счетчики типов пересчитаны")
@@ -0,0 +1,45 @@
+"""Быстрая сериализация ответов каталога.
+
+Видео и фотоальбомы - доверенные данные из своей базы, поэтому горячие
+маршруты на чтение собирают ответ из кортежей строк (select по столбцам, без
+ORM-объектов и identity map) и кодируют его сразу, без проверки моделями
+pydantic. Кодировщик - orjson, если установлен, иначе json из стандартной
+библиотеки; какой из них работает, показывает поле encoder в отчете
+python bench.py serialization. Ответ совпадает с моделями schemas байт в байт (порядок полей,
+даты в ISO 8601), поэтому ETag не меняется.
+
+FAST_SERIALIZATION=0 возвращает путь через ORM и модели - для сравнения
+(python bench.py serialization) и на случай расхождений.
+"""
+import json
+import os
+from datetime import datetime
+from typing import List
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - необязательная зависимость
+    orjson = None
+
+ENABLED = os.getenv("FAST_SERIALIZATION", "1") != "0"
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в JSON")
+
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=_default)
+
+
+def dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return _encoder.encode(data).encode("utf-8")
+
+
+def rows(result) -> List[dict]:
+    """Строки результата -> словари; в разы дешевле, чем dict() по каждой RowMapping"""
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
@@ -0,0 +1,122 @@
+"""Пул потоков для bcrypt.
+
+Хеширование и проверка паролей занимают десятки миллисекунд CPU, поэтому
+выполняются вне event loop в ограниченном пуле. bcrypt отпускает GIL, так что
+потоков достаточно. Если очередь заполнена, запрос сразу получает 503.
+
+Настройки через переменные окружения:
+    HASH_POOL_WORKERS     - количество потоков (по умолчанию число CPU)
+    HASH_POOL_QUEUE_DEPTH - сколько операций может ждать в очереди (по умолчанию 32)
+
+passlib загружается при первом обращении к get_pwd_context(), а не при импорте:
+воркер стартует быстрее, загрузку после старта делает warm_up() в пуле.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from fastapi import HTTPException
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_pwd_context():
+    """Настройка хеширования паролей"""
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def _hash_password(password: str) -> str:
+    return get_pwd_context().hash(password)
+
+
+def _verify_password(plain_password: str, hashed_password: str) -> bool:
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    def __init__(self, max_workers: int, queue_depth: int):
+        self.max_workers = max_workers
+        self.queue_depth = queue_depth
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._pending = 0  # меняется только из event loop
+        self._lock = threading.Lock()  # для счетчиков, которые пишут рабочие потоки
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._hash_total = 0.0
+
+    def _record(self, operation: str, wait: float, duration: float):
+        with self._lock:
+            self._completed += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self._hash_total += duration
+        metrics.PASSWORD_HASH_WAIT_SECONDS.observe(wait, operation)
+        metrics.PASSWORD_HASH_SECONDS.observe(duration, operation)
+
+    async def _run(self, operation: str, fn, *args):
+        if self._pending >= self.max_workers + self.queue_depth:
+            self._rejected += 1
+            metrics.PASSWORD_HASH_REJECTED.inc()
+            logger.warning(f"Очередь хеширования заполнена ({self._pending} операций)")
+            raise HTTPException(
+                status_code=503,
+                detail="Сервер перегружен, попробуйте позже",
+                headers={"Retry-After": "1"}
+            )
+
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                self._record(operation, started - submitted, time.perf_counter() - started)
+
+        self._pending += 1
+        metrics.PASSWORD_HASH_PENDING.inc()
+        try:
+            return await asyncio.wrap_future(self._executor.submit(job))
+        finally:
+            self._pending -= 1
+            metrics.PASSWORD_HASH_PENDING.dec()
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run("verify", _verify_password, plain_password, hashed_password)
+
+    def warm_up(self):
+        """Загрузка passlib в фоне, чтобы первый вход не ждал импорта"""
+        self._executor.submit(get_pwd_context)
+
+    def stats(self) -> dict:
+        with self._lock:
+            completed = self._completed
+            return {
+                "workers": self.max_workers,
+                "queue_depth": self.queue_depth,
+                "pending": self._pending,
+                "completed": completed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._wait_total / completed * 1000, 2) if completed else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 2),
+                "avg_hash_ms": round(self._hash_total / completed * 1000, 2) if completed else 0.0,
+            }
+
+
+hasher = PasswordHasher(
+    max_workers=int(os.getenv("HASH_POOL_WORKERS", os.cpu_count() or 2)),
+    queue_depth=int(os.getenv("HASH_POOL_QUEUE_DEPTH", 32)),
+)
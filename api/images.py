@@ -0,0 +1,199 @@
+"""Адаптивные версии загруженных изображений.
+
+После загрузки из исходника в пуле процессов строятся WebP (и при
+IMAGE_AVIF=1 - AVIF) копии нескольких ширин и крошечная размытая заглушка.
+Для загрузок файлы кладутся рядом с оригиналом в хранилище:
+photo.jpg -> photo.640w.webp.
+
+Для уже лежащих в репозитории картинок:
+
+    python images.py backfill [каталог]   # по умолчанию templates/assets
+
+Варианты таких картинок пишутся не рядом с исходниками (templates/ под git и
+попадает в сборку статики), а в IMAGE_VARIANTS_DIR (по умолчанию
+api/static/variants, в .gitignore) с тем же относительным путем:
+templates/assets/photo.jpg -> /static/variants/assets/photo.640w.webp.
+
+Требуется Pillow; без него загрузка работает как раньше, без вариантов.
+Pillow и пул процессов импортируются при первой обработке картинки, поэтому
+импорт модуля (и main в каждом воркере) их не загружает.
+"""
+import asyncio
+import base64
+import importlib.util
+import io
+import logging
+import os
+import re
+import sys
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+VARIANTS_DIR = os.getenv("IMAGE_VARIANTS_DIR", os.path.join(BASE_DIR, "static", "variants"))
+VARIANTS_URL_PREFIX = "/static/variants"
+
+VARIANT_WIDTHS = tuple(int(w) for w in os.getenv("IMAGE_VARIANT_WIDTHS", "320,640,1280,1920").split(","))
+WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", 80))
+AVIF_ENABLED = os.getenv("IMAGE_AVIF", "0") == "1"
+AVIF_QUALITY = int(os.getenv("IMAGE_AVIF_QUALITY", 60))
+PLACEHOLDER_WIDTH = 16
+SOURCE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp", ".tiff"}
+
+# Имена уже созданных вариантов: name.640w.webp / name.640w.avif
+VARIANT_RE = re.compile(r"\.\d+w\.(webp|avif)$")
+
+_pool: Optional["ProcessPoolExecutor"] = None
+
+
+@lru_cache(maxsize=None)
+def enabled() -> bool:
+    return importlib.util.find_spec("PIL") is not None
+
+
+def _formats():
+    from PIL import Image
+
+    Image.init()
+    formats = [("webp", "WEBP", {"quality": WEBP_QUALITY, "method": 4})]
+    if AVIF_ENABLED and "AVIF" in Image.SAVE:
+        formats.append(("avif", "AVIF", {"quality": AVIF_QUALITY}))
+    return formats
+
+
+def render_variants(path: str, force: bool = True, out_dir: Optional[str] = None) -> dict:
+    """Создание вариантов для одного файла (выполняется в дочернем процессе).
+
+    out_dir - каталог для вариантов, по умолчанию каталог исходника.
+    """
+    from PIL import Image, ImageFilter, ImageOps
+
+    stem = os.path.splitext(path)[0]
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+        stem = os.path.join(out_dir, os.path.basename(stem))
+    with Image.open(path) as source:
+        image = ImageOps.exif_transpose(source)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        width, height = image.size
+
+        # Ширины меньше оригинала плюс сам оригинал, если он меньше максимальной
+        widths = sorted({w for w in VARIANT_WIDTHS if w < width} | {min(width, max(VARIANT_WIDTHS))})
+        variants = []
+        for target_width in widths:
+            target_height = max(1, round(height * target_width / width))
+            resized = image if target_width == width else image.resize((target_width, target_height), Image.LANCZOS)
+            for extension, pil_format, options in _formats():
+                out_path = f"{stem}.{target_width}w.{extension}"
+                if force or not os.path.exists(out_path) or os.path.getmtime(out_path) < os.path.getmtime(path):
+                    resized.save(out_path, pil_format, **options)
+                variants.append({
+                    "filename": os.path.basename(out_path),
+                    "width": target_width,
+                    "height": target_height,
+                    "format": extension,
+                })
+
+        placeholder_height = max(1, round(height * PLACEHOLDER_WIDTH / width))
+        tiny = image.resize((PLACEHOLDER_WIDTH, placeholder_height), Image.BILINEAR)
+        tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+        buffer = io.BytesIO()
+        tiny.save(buffer, "WEBP", quality=30)
+
+    return {
+        "width": width,
+        "height": height,
+        "variants": variants,
+        "placeholder": "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode("ascii"),
+    }
+
+
+def _get_pool() -> "ProcessPoolExecutor":
+    global _pool
+    if _pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+
+        _pool = ProcessPoolExecutor(max_workers=int(os.getenv("IMAGE_POOL_WORKERS", 2)))
+    return _pool
+
+
+def shutdown():
+    """Остановка пула процессов (при остановке приложения)"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+def _with_urls(result: dict, url: str) -> dict:
+    base_url = url.rsplit("/", 1)[0]
+    for variant in result["variants"]:
+        variant["url"] = f"{base_url}/{variant['filename']}"
+    webp = [v for v in result["variants"] if v["format"] == "webp"]
+    result["srcset"] = ", ".join(f"{v['url']} {v['width']}w" for v in webp)
+    return result
+
+
+async def create_variants(path: str, url: str) -> dict:
+    """Варианты для загруженного файла; ошибки обработки не ломают загрузку"""
+    empty = {"variants": [], "srcset": "", "placeholder": None}
+    if not enabled():
+        return empty
+    try:
+        loop = asyncio.get_running_loop()
+        # Существующие актуальные варианты (повторная загрузка того же файла) не пересоздаются
+        result = await loop.run_in_executor(_get_pool(), render_variants, path, False)
+    except Exception as e:
+        logger.error(f"Ошибка при создании вариантов изображения {path}: {str(e)}")
+        return empty
+    return _with_urls(result, url)
+
+
+def _variants_dir(source_dir: str, root: str) -> str:
+    # Путь относительно сайта (templates/), чтобы URL вариантов повторял URL исходника
+    base = TEMPLATES_DIR if os.path.commonpath([TEMPLATES_DIR, source_dir]) == TEMPLATES_DIR else root
+    return os.path.normpath(os.path.join(VARIANTS_DIR, os.path.relpath(source_dir, base)))
+
+
+def backfill(root: str, workers: Optional[int] = None):
+    """Создание недостающих вариантов для всех изображений в каталоге (в VARIANTS_DIR)"""
+    root = os.path.abspath(root)
+    paths = [
+        os.path.join(dirpath, name)
+        for dirpath, _, names in os.walk(root)
+        for name in names
+        if os.path.splitext(name)[1].lower() in SOURCE_EXTENSIONS and not VARIANT_RE.search(name)
+    ]
+    logger.info(f"Найдено изображений: {len(paths)}")
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(render_variants, path, False, _variants_dir(os.path.dirname(path), root)): path
+            for path in paths
+        }
+        for done, future in enumerate(futures, 1):
+            path = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Ошибка при обработке {path}: {str(e)}")
+            if done % 50 == 0 or done == len(paths):
+                logger.info(f"Обработано {done}/{len(paths)}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:2] != ["backfill"]:
+        print("Использование: python images.py backfill [каталог]")
+        sys.exit(1)
+    if not enabled():
+        print("Для обработки изображений нужен Pillow")
+        sys.exit(1)
+    backfill(sys.argv[2] if len(sys.argv) > 2 else os.path.join(BASE_DIR, "templates", "assets"))
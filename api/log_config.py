@@ -0,0 +1,246 @@
+"""Логирование через очередь в формате JSON.
+
+Обработчики с вводом-выводом работают в фоновом потоке QueueListener, а в
+event loop остается только постановка записи в очередь. До постановки
+записи проходят фильтры:
+- выборка по логгерам для сообщений ниже WARNING
+  (LOG_SAMPLING="sqlalchemy.engine=0.01,catalog_cache=0.1");
+- ограничение частоты по месту вызова: не больше LOG_RATE_LIMIT сообщений в
+  секунду с одной строки кода (ERROR и выше и строки доступа не
+  ограничиваются), число пропущенных попадает в поле suppressed следующей записи.
+
+RequestContextMiddleware добавляет к каждой записи в рамках запроса поля
+request_id, method, path, route, user_id и elapsed_ms, а по завершении пишет
+строку доступа. Успешные быстрые запросы попадают в нее с долей
+LOG_ACCESS_SAMPLE, ошибки и медленные (дольше LOG_SLOW_MS) - всегда.
+
+LOG_FORMAT=text возвращает обычный текстовый вывод (для локальной отладки).
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+import metrics
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", 20))
+LOG_ACCESS_SAMPLE = float(os.getenv("LOG_ACCESS_SAMPLE", 0.1))
+LOG_SLOW_MS = float(os.getenv("LOG_SLOW_MS", 500))
+
+# Стандартные атрибуты LogRecord; все остальные (extra=...) выводятся как поля
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "context", "suppressed"}
+
+_context: ContextVar[Optional[dict]] = ContextVar("log_context", default=None)
+_listener: Optional[QueueListener] = None
+
+access_logger = logging.getLogger("access")
+
+
+def bind(**fields):
+    """Дополнительные поля для всех записей текущего запроса (например, user_id)"""
+    context = _context.get()
+    if context is not None:
+        context.update(fields)
+
+
+def _parse_sampling(value: str) -> dict:
+    rates = {}
+    for part in filter(None, (item.strip() for item in value.split(","))):
+        name, _, rate = part.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        name = record.name
+        while name:
+            rate = self.rates.get(name)
+            if rate is not None:
+                return random.random() < rate
+            name = name.rpartition(".")[0]
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Токен-бакет на место вызова (файл и строка), чтобы f-строки не мешали группировке"""
+
+    def __init__(self, per_second: float):
+        super().__init__()
+        self.per_second = per_second
+        self._buckets = {}  # место вызова -> [токены, время, пропущено]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.per_second <= 0 or record.levelno >= logging.ERROR or record.name == access_logger.name:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.per_second, now, 0]
+            bucket[0] = min(self.per_second, bucket[0] + (now - bucket[1]) * self.per_second)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+class ContextQueueHandler(QueueHandler):
+    """Снимок контекста запроса делается в вызывающем потоке, форматирование - в фоне"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        context = _context.get()
+        if context is not None:
+            record.context = _context_fields(context)
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Очередь переполнена: лучше потерять запись, чем блокировать event loop
+            self.dropped += 1
+
+
+def _context_fields(context: dict) -> dict:
+    fields = {key: value for key, value in context.items() if key not in ("scope", "started")}
+    fields["route"] = metrics.route_label(context["scope"])
+    fields["elapsed_ms"] = round((time.perf_counter() - context["started"]) * 1000, 2)
+    return fields
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        payload.update(getattr(record, "context", None) or {})
+        payload.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS})
+        if getattr(record, "suppressed", None):
+            payload["suppressed"] = record.suppressed
+        if record.exc_text:
+            payload["exception"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        context = getattr(record, "context", None)
+        if context:
+            line += " " + " ".join(f"{key}={value}" for key, value in context.items())
+        return line
+
+
+def setup_logging():
+    """Корневой логгер -> очередь -> фоновый поток -> stderr (один раз на процесс)"""
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+
+    handler = ContextQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(_parse_sampling(os.getenv("LOG_SAMPLING", ""))))
+    handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Дописывает очередь и останавливает фоновый поток"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+class RequestContextMiddleware:
+    """Контекст запроса для логов и строка доступа по завершении"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        context = {
+            "request_id": request_id or uuid.uuid4().hex,
+            "method": scope["method"],
+            "path": scope["path"],
+            "scope": scope,
+            "started": time.perf_counter(),
+        }
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", ()), (b"x-request-id", context["request_id"].encode("latin-1"))]
+            await send(message)
+
+        token = _context.set(context)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed_ms = (time.perf_counter() - context["started"]) * 1000
+            if status >= 500 or elapsed_ms >= LOG_SLOW_MS or random.random() < LOG_ACCESS_SAMPLE:
+                access_logger.info(f"{scope['method']} {scope['path']} {status}", extra={"status": status})
+            _context.reset(token)
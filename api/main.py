@@ -1,25 +1,44 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request, UploadFile, File
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Depends, HTTPException, status, Request, UploadFile, File, Query
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
-from jose import JWTError, jwt
+from fastapi.responses import JSONResponse, Response
+from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
-from typing import Optional, List
-from pydantic import BaseModel
+from typing import Optional, List, Tuple, Union
+from pydantic import BaseModel, Field, TypeAdapter
 import models
 import schemas
-from database import engine, SessionLocal, get_db
+import stats
+import search
+import facets
+import fast_json
+import images
+import uploads
+import blobs
+import album_images
+import compression
+import migrations
+import metrics
+import query_budget
+import log_config
+from static_assets import CachedStaticFiles, ImmutableStaticFiles
+from hashing import hasher
+from principals import principal_cache
+from catalog_cache import catalog_cache, cached_response, watch_catalog_version
+from database import engine, async_engine, SessionLocal, get_db, get_async_db, sqlite_settings
+from pagination import encode_cursor, decode_cursor, escape_like
+import asyncio
 import logging
 import re
 import os
-import shutil
-from sqlalchemy import func
+from sqlalchemy import func, or_, select, text, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Настройка логирования: JSON через очередь и фоновый поток (см. log_config.py)
+log_config.setup_logging()
 logger = logging.getLogger(__name__)
 
 # Инициализация FastAPI
@@ -35,6 +54,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Request-ID"],
     max_age=3600,
 )
 
@@ -55,12 +75,14 @@ SECRET_KEY = "5f4dcc3b5aa765d61d8327deb882cf99b0b1a6d8a1e2b3c4d5e6f7a8b9c0d1e2"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Настройка хеширования паролей
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# Создаем таблицы в БД (если их нет)
-models.Base.metadata.create_all(bind=engine)
+# Создаем и обновляем схему БД. serve.py делает это один раз до запуска
+# воркеров и выставляет SCHEMA_PREPARED=1; без него (uvicorn main:app,
+# скрипты) - здесь, при импорте
+if os.getenv("SCHEMA_PREPARED") != "1":
+    migrations.prepare_database(engine)
+logger.info(f"Настройки SQLite: {sqlite_settings()}")
 
 # --- Pydantic-схемы ---
 class UserCreate(BaseModel):
@@ -77,17 +99,24 @@ class UserProgressUpdate(BaseModel):
     lesson_id: int
     is_completed: bool
 
+class UserProgressBatch(BaseModel):
+    items: List[UserProgressUpdate] = Field(max_length=100)
+
 class Token(BaseModel):
     access_token: str
     token_type: str
     user_id: int
 
+TOTAL_LESSONS = stats.TOTAL_LESSONS
+DATE_REG_RE = re.compile(r'\d{2}\.\d{2}\.\d{4}')
+
 # --- Вспомогательные функции ---
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+# bcrypt выполняется в пуле потоков (см. hashing.py), а не в event loop
+async def get_password_hash(password: str) -> str:
+    return await hasher.hash(password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await hasher.verify(plain_password, hashed_password)
 
 def get_db():
     db = SessionLocal()
@@ -96,9 +125,39 @@ def get_db():
     finally:
         db.close()
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if not user or not verify_password(password, user.hashed_password):
+def json_bytes(data) -> bytes:
+    return fast_json.dumps(data)
+
+def format_date_reg(date_reg):
+    """Приведение даты регистрации к формату DD.MM.YYYY"""
+    if not isinstance(date_reg, str) or DATE_REG_RE.match(date_reg):
+        return date_reg
+    try:
+        return datetime.strptime(date_reg, "%Y-%m-%d").strftime("%d.%m.%Y")
+    except ValueError:
+        return "Не указана"
+
+# Запросы через синхронную Session из async-эндпоинтов выполняются в пуле потоков:
+# ожидание блокировки SQLite (busy_timeout) не должно останавливать цикл событий
+def find_user(db: Session, username: str) -> Optional[models.User]:
+    return db.query(models.User).filter(models.User.username == username).first()
+
+def create_user(db: Session, user: UserCreate, hashed_password: str, is_admin: bool) -> models.User:
+    db_user = models.User(
+        first_name=user.first_name,
+        last_name=user.last_name,
+        username=user.username,
+        hashed_password=hashed_password,
+        is_admin=1 if is_admin else 0  # В базе хранится 0/1
+    )
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    return db_user
+
+async def authenticate_user(db: Session, username: str, password: str):
+    user = await run_in_threadpool(find_user, db, username)
+    if not user or not await verify_password(password, user.hashed_password):
         return False
     return user
 
@@ -109,15 +168,18 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
+    # python-jose импортируется при первом использовании, а не при старте воркера
+    from jose import jwt
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Неверные учетные данные",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    from jose import JWTError, jwt
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -126,9 +188,15 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.username == username).first()
+    # Пользователь из кеша не требует обращения к БД
+    user = principal_cache.get(username)
     if user is None:
-        raise credentials_exception
+        version = principal_cache.version
+        user = await db.scalar(select(models.User).where(models.User.username == username))
+        if user is None:
+            raise credentials_exception
+        principal_cache.put(username, user, version)
+    log_config.bind(user_id=user.id)
     return user
 
 # Добавляем функцию проверки прав администратора
@@ -142,23 +210,15 @@ async def get_current_admin(current_user: models.User = Depends(get_current_user
 
 # --- Роуты API ---
 @app.post("/register/", response_model=Token)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
+@query_budget.budget(4)
+async def register_user(user: UserCreate, db: Session = Depends(get_db)):
     # Проверяем, не занят ли логин
-    if db.query(models.User).filter(models.User.username == user.username).first():
+    if await run_in_threadpool(find_user, db, user.username):
         raise HTTPException(status_code=400, detail="Логин уже занят")
     
     # Создаем пользователя
-    hashed_password = get_password_hash(user.password)
-    db_user = models.User(
-        first_name=user.first_name,
-        last_name=user.last_name,
-        username=user.username,
-        hashed_password=hashed_password,
-        is_admin=0  # Явно указываем, что это не админ
-    )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    hashed_password = await get_password_hash(user.password)
+    db_user = await run_in_threadpool(create_user, db, user, hashed_password, False)
     
     # Создаем токен для автоматического входа
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -172,11 +232,12 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
     }
 
 @app.post("/token", response_model=Token)
+@query_budget.budget(1)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -193,49 +254,100 @@ async def login_for_access_token(
         "user_id": user.id
     }
 
+def sync_progress(db: Session, user_id: int, items: List[UserProgressUpdate]) -> list:
+    """Применение состояний уроков одним INSERT ... ON CONFLICT DO UPDATE.
+
+    Счетчики статистики меняют триггеры на user_progress (см. stats.py).
+    Возвращает итоговый прогресс пользователя; commit делает вызывающий.
+    """
+    # При повторе урока в запросе побеждает последнее состояние
+    desired = {item.lesson_id: int(item.is_completed) for item in items}
+    if desired:
+        stmt = sqlite_insert(models.UserProgress).values([
+            {"user_id": user_id, "lesson_id": lesson_id, "is_completed": is_completed}
+            for lesson_id, is_completed in desired.items()
+        ])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[models.UserProgress.user_id, models.UserProgress.lesson_id],
+            set_={"is_completed": stmt.excluded.is_completed}
+        ))
+    # Читается после записи, в той же транзакции
+    rows = db.execute(
+        select(
+            models.UserProgress.id,
+            models.UserProgress.user_id,
+            models.UserProgress.lesson_id,
+            models.UserProgress.is_completed
+        ).where(
+            models.UserProgress.user_id == user_id
+        ).order_by(models.UserProgress.lesson_id)
+    ).mappings()
+    return [dict(row) for row in rows]
+
+def save_progress(db: Session, user_id: int, items: List[UserProgressUpdate]) -> list:
+    """sync_progress() и commit; выполняется в пуле потоков (запись может ждать busy_timeout)"""
+    try:
+        progress = sync_progress(db, user_id, items)
+        db.commit()
+        return progress
+    except Exception:
+        db.rollback()
+        raise
+
 @app.post("/progress/")
+@query_budget.budget(5)
 async def update_progress(
     progress: UserProgressUpdate,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     try:
-        # Обновляем или создаем запись о прогрессе
-        db_progress = db.query(models.UserProgress).filter(
-            models.UserProgress.user_id == current_user.id,
-            models.UserProgress.lesson_id == progress.lesson_id
-        ).first()
-
-        if db_progress:
-            db_progress.is_completed = progress.is_completed
-        else:
-            db_progress = models.UserProgress(
-                user_id=current_user.id,
-                lesson_id=progress.lesson_id,
-                is_completed=progress.is_completed
-            )
-            db.add(db_progress)
-        
-        db.commit()
+        await run_in_threadpool(save_progress, db, current_user.id, [progress])
         return {"status": "Прогресс обновлен"}
     except Exception as e:
         logger.error(f"Error updating progress: {str(e)}")
-        db.rollback()
         raise HTTPException(
             status_code=500,
             detail="Ошибка при обновлении прогресса"
         )
 
-@app.get("/progress/")
-async def get_user_progress(
+@app.post("/progress/batch")
+@query_budget.budget(5)
+async def update_progress_batch(
+    batch: UserProgressBatch,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
+    """Состояния нескольких уроков за один запрос и одну транзакцию"""
     try:
-        progress = db.query(models.UserProgress).filter(
-            models.UserProgress.user_id == current_user.id
-        ).all()
+        progress = await run_in_threadpool(save_progress, db, current_user.id, batch.items)
         return {"progress": progress}
+    except Exception as e:
+        logger.error(f"Error updating progress: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="Ошибка при обновлении прогресса"
+        )
+
+async def load_progress(db: AsyncSession, user_id: int) -> List[dict]:
+    result = await db.execute(
+        select(
+            models.UserProgress.id,
+            models.UserProgress.user_id,
+            models.UserProgress.lesson_id,
+            models.UserProgress.is_completed
+        ).where(models.UserProgress.user_id == user_id)
+    )
+    return [dict(row) for row in result.mappings()]
+
+@app.get("/progress/")
+@query_budget.budget(2)
+async def get_user_progress(
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    try:
+        return {"progress": await load_progress(db, current_user.id)}
     except Exception as e:
         logger.error(f"Error getting progress: {str(e)}")
         raise HTTPException(
@@ -243,71 +355,123 @@ async def get_user_progress(
             detail="Ошибка при получении прогресса"
         )
 
-@app.get("/users/me/")
-async def read_users_me(current_user: models.User = Depends(get_current_user)):
+def user_payload(user: models.User) -> dict:
     return {
-        "id": current_user.id,
-        "username": current_user.username,
-        "first_name": current_user.first_name,
-        "last_name": current_user.last_name,
-        "is_admin": current_user.is_admin  # Возвращаем числовое значение
+        "id": user.id,
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "is_admin": user.is_admin  # Возвращаем числовое значение
     }
 
+@app.get("/users/me/")
+@query_budget.budget(1)
+async def read_users_me(current_user: models.User = Depends(get_current_user)):
+    return user_payload(current_user)
+
 @app.get("/admin/users/")
-async def get_users(current_user: models.User = Depends(get_current_admin), db: Session = Depends(get_db)):
+@query_budget.budget(2)
+async def get_users(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    sort: str = Query("id", pattern="^(id|username|progress)$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    username: Optional[str] = None,
+    is_admin: Optional[bool] = None,
+    current_user: models.User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    """Список пользователей с прогрессом: один запрос и keyset-пагинация"""
     try:
-        # Получаем всех пользователей
-        users = db.query(models.User).all()
-        
-        # Преобразуем в список словарей
-        result = []
-        for user in users:
-            # Вычисляем прогресс
-            total_lessons = 12  # Фиксированное количество уроков
-            completed_lessons = db.query(models.UserProgress).filter(
-                models.UserProgress.user_id == user.id,
-                models.UserProgress.is_completed == True
-            ).count()
-            
-            progress = int((completed_lessons / total_lessons * 100) if total_lessons > 0 else 0)
-            
-            # Форматируем дату регистрации
-            date_reg = user.date_reg
-            if isinstance(date_reg, str):
-                try:
-                    # Если дата в формате DD.MM.YYYY, оставляем как есть
-                    if re.match(r'\d{2}\.\d{2}\.\d{4}', date_reg):
-                        pass
-                    else:
-                        # Пробуем другие форматы
-                        date_obj = datetime.strptime(date_reg, "%Y-%m-%d")
-                        date_reg = date_obj.strftime("%d.%m.%Y")
-                except Exception as e:
-                    logger.error(f"Ошибка форматирования даты: {str(e)}")
-                    date_reg = "Не указана"
-            
-            user_dict = {
-                "id": user.id,
-                "username": user.username,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "progress": progress,
-                "date_reg": date_reg,
-                "is_admin": bool(user.is_admin)  # Преобразуем в булево значение
+        # Количество пройденных уроков - готовый счетчик user_stats (см. stats.py)
+        completed = models.UserStats.completed_lessons
+        query = db.query(
+            models.User.id,
+            models.User.username,
+            models.User.first_name,
+            models.User.last_name,
+            models.User.is_admin,
+            models.User.date_reg,
+            completed.label("completed")
+        ).join(models.UserStats, models.UserStats.user_id == models.User.id)
+
+        # Фильтры. Префикс логина - диапазон по индексу (username без учета
+        # регистра, id); LIKE (тоже без учета регистра) оставляет точное условие
+        if username:
+            query = query.filter(
+                models.USERNAME_SORT_KEY >= username,
+                models.USERNAME_SORT_KEY < username + "\U0010ffff",
+                models.User.username.like(f"{escape_like(username)}%", escape="\\")
+            )
+        if is_admin is not None:
+            if sort == "id":
+                # Совпадает с индексом (флаг, id): страница по id без сортировки
+                query = query.filter(models.ADMIN_FLAG == int(is_admin))
+            else:
+                # С параметром вместо литерала выражение не совпадает с индексом флага,
+                # и план идет по индексу сортировки, а не сортирует всех обычных пользователей
+                admin_flag = func.coalesce(models.User.is_admin, 0)
+                query = query.filter(admin_flag != 0 if is_admin else admin_flag == 0)
+
+        # Сортировка: ключ + id как уникальный тай-брейкер для курсора.
+        # Для прогресса id берется из user_stats, чтобы шел индекс (completed_lessons, user_id)
+        sort_key = {
+            "id": models.User.id,
+            "username": models.USERNAME_SORT_KEY,
+            "progress": completed,
+        }[sort]
+        id_key = models.UserStats.user_id if sort == "progress" else models.User.id
+        if cursor:
+            last_value, last_id = decode_cursor(cursor, 2)
+            if sort == "id":
+                query = query.filter(id_key < last_id if order == "desc" else id_key > last_id)
+            elif order == "desc":
+                # Раскрытое сравнение пар: по выражению (ключ, id) SQLite ищет в индексе, а не сканирует его
+                query = query.filter(sort_key <= last_value, or_(sort_key < last_value, id_key < last_id))
+            else:
+                query = query.filter(sort_key >= last_value, or_(sort_key > last_value, id_key > last_id))
+        if order == "desc":
+            query = query.order_by(sort_key.desc(), id_key.desc())
+        else:
+            query = query.order_by(sort_key, id_key)
+
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        result = [
+            {
+                "id": row.id,
+                "username": row.username,
+                "first_name": row.first_name,
+                "last_name": row.last_name,
+                "progress": int(row.completed / TOTAL_LESSONS * 100),
+                "date_reg": format_date_reg(row.date_reg),
+                "is_admin": bool(row.is_admin)  # Преобразуем в булево значение
             }
-            
-            # Отладочный вывод
-            logger.info(f"Пользователь {user.username}: is_admin = {user.is_admin}, type = {type(user.is_admin)}")
-            
-            result.append(user_dict)
-        
-        return {"users": result}
+            for row in rows
+        ]
+
+        next_cursor = None
+        if has_more:
+            last = rows[-1]
+            last_value = {
+                "id": last.id,
+                "username": last.username or "",
+                "progress": last.completed,
+            }[sort]
+            next_cursor = encode_cursor(last_value, last.id)
+
+        return {"users": result, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при получении списка пользователей: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # Добавляем эндпоинт для создания администратора
 @app.post("/admin/create/")
+@query_budget.budget(5)
 async def create_admin(
     user: UserCreate,
     current_user: models.User = Depends(get_current_admin),
@@ -315,23 +479,16 @@ async def create_admin(
 ):
     try:
         # Проверяем, не занят ли логин
-        if db.query(models.User).filter(models.User.username == user.username).first():
+        if await run_in_threadpool(find_user, db, user.username):
             raise HTTPException(status_code=400, detail="Логин уже занят")
         
         # Создаем пользователя с правами администратора
-        hashed_password = get_password_hash(user.password)
-        db_user = models.User(
-            first_name=user.first_name,
-            last_name=user.last_name,
-            username=user.username,
-            hashed_password=hashed_password,
-            is_admin=1  # Устанавливаем 1 вместо True
-        )
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        hashed_password = await get_password_hash(user.password)
+        await run_in_threadpool(create_user, db, user, hashed_password, True)
         
         return {"status": "Администратор успешно создан"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creating admin: {str(e)}")
         db.rollback()
@@ -341,6 +498,7 @@ async def create_admin(
         )
 
 @app.get("/users/{user_id}")
+@query_budget.budget(2)
 async def get_user(
     user_id: int,
     current_user: models.User = Depends(get_current_admin),
@@ -359,11 +517,14 @@ async def get_user(
             "last_name": user.last_name,
             "is_admin": user.is_admin
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при получении пользователя: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/users/{user_id}")
+@query_budget.budget(5)
 async def update_user(
     user_id: int,
     user_data: UserCreate,
@@ -389,9 +550,10 @@ async def update_user(
         
         # Обновляем пароль только если он указан
         if user_data.password:
-            user.hashed_password = get_password_hash(user_data.password)
+            user.hashed_password = await get_password_hash(user_data.password)
         
         db.commit()
+        principal_cache.invalidate()
         return {"message": "Пользователь успешно обновлен"}
     except HTTPException:
         raise
@@ -400,6 +562,7 @@ async def update_user(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/users/{user_id}")
+@query_budget.budget(8)
 async def delete_user(
     user_id: int,
     current_user: models.User = Depends(get_current_admin),
@@ -415,8 +578,10 @@ async def delete_user(
         if user.id == current_user.id:
             raise HTTPException(status_code=400, detail="Нельзя удалить свой аккаунт")
         
+        stats.user_deleted(db, user)
         db.delete(user)
         db.commit()
+        principal_cache.invalidate()
         return {"message": "Пользователь успешно удален"}
     except HTTPException:
         raise
@@ -425,6 +590,7 @@ async def delete_user(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/users/{user_id}/toggle-admin")
+@query_budget.budget(5)
 async def toggle_admin(
     user_id: int,
     admin_data: dict,
@@ -442,119 +608,321 @@ async def toggle_admin(
             raise HTTPException(status_code=400, detail="Нельзя изменить свои права администратора")
         
         # Обновляем права администратора
-        user.is_admin = admin_data.get("is_admin", False)
+        is_admin = admin_data.get("is_admin", False)
+        user.is_admin = is_admin
         db.commit()
+        principal_cache.invalidate()
         
         return {"message": "Права администратора успешно обновлены"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при изменении прав администратора: {str(e)}")
+        db.rollback()
         raise HTTPException(status_code=500, detail="Ошибка при изменении прав администратора")
 
 @app.get("/admin/stats/")
+@query_budget.budget(2)
 async def get_stats(current_user: models.User = Depends(get_current_admin), db: Session = Depends(get_db)):
     try:
-        # Общее количество пользователей
-        total_users = db.query(models.User).count()
-        
-        # Количество администраторов
-        admin_count = db.query(models.User).filter(models.User.is_admin == True).count()
-        
-        # Количество обычных пользователей
-        regular_users = total_users - admin_count
-        
-        # Средний прогресс по всем пользователям
-        avg_progress = db.query(
-            func.avg(models.User.progress)
-        ).scalar() or 0
-        
-        return {
-            "total_users": total_users,
-            "admin_count": admin_count,
-            "regular_users": regular_users,
-            "avg_progress": round(float(avg_progress), 1)
-        }
+        # Агрегаты поддерживаются инкрементально, здесь только чтение
+        return stats.read_stats(db)
     except Exception as e:
         logger.error(f"Ошибка при получении статистики: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/admin/hash-pool/")
+@query_budget.budget(1)
+async def get_hash_pool_stats(current_user: models.User = Depends(get_current_admin)):
+    """Состояние пула bcrypt: очередь, время ожидания и хеширования"""
+    return hasher.stats()
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+@app.get("/metrics", include_in_schema=False)
+@query_budget.budget(0)
+async def get_metrics(request: Request):
+    """Метрики в текстовом формате Prometheus; при METRICS_TOKEN нужен Bearer-токен"""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    return Response(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/health/live", include_in_schema=False)
+@query_budget.budget(0)
+async def health_live():
+    """Процесс жив и event loop отвечает"""
+    return {"status": "ok"}
+
+@app.get("/health/ready", include_in_schema=False)
+@query_budget.budget(1)
+async def health_ready():
+    """Воркер запущен, не останавливается и база доступна; иначе 503"""
+    if not getattr(app.state, "ready", False):
+        state = "stopping" if getattr(app.state, "stopping", False) else "starting"
+        return JSONResponse(status_code=503, content={"status": state})
+    try:
+        async with async_engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+    except Exception as e:
+        logger.error(f"Проверка готовности: база недоступна: {str(e)}")
+        return JSONResponse(status_code=503, content={"status": "database unavailable"})
+    return {"status": "ok"}
+
+VIDEO_COLUMNS = (
+    models.Video.id,
+    models.Video.title,
+    models.Video.artist,
+    models.Video.type,
+    models.Video.youtube_url,
+    models.Video.thumbnail_url,
+    models.Video.order
+)
+
 @app.get("/videos/{video_id}")
-async def get_video(video_id: int, current_user: models.User = Depends(get_current_user)):
+@query_budget.budget(2)
+async def get_video(
+    video_id: int,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
     try:
-        db = SessionLocal()
-        video = db.query(models.Video).filter(models.Video.id == video_id).first()
+        result = await db.execute(select(*VIDEO_COLUMNS).where(models.Video.id == video_id))
+        video = result.mappings().first()
         if not video:
             raise HTTPException(status_code=404, detail="Video not found")
-        
-        return {
-            "id": video.id,
-            "title": video.title,
-            "artist": video.artist,
-            "type": video.type,
-            "youtube_url": video.youtube_url,
-            "thumbnail_url": video.thumbnail_url,
-            "order": video.order
-        }
+        return dict(video)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error getting video: {str(e)}")
+        logger.error(f"Error getting video: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
-    finally:
-        db.close()
 
 @app.get("/videos/")
-async def get_videos():
+@query_budget.budget(1)
+async def get_videos(
+    request: Request,
+    type_: Optional[str] = Query(None, alias="type", max_length=100),
+    artist: Optional[str] = Query(None, max_length=200),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Список видео; type и artist - фильтры для вкладок (по индексам (type|artist, order, id))"""
+    async def build():
+        query = select(*VIDEO_COLUMNS)
+        if type_ is not None:
+            query = query.where(models.Video.type == type_)
+        if artist is not None:
+            query = query.where(models.Video.artist == artist)
+        result = await db.execute(query.order_by(models.Video.order, models.Video.id))
+        if fast_json.ENABLED:
+            return json_bytes({"videos": fast_json.rows(result)})
+        return json_bytes({"videos": [dict(video) for video in result.mappings()]})
+
     try:
-        db = SessionLocal()
-        videos = db.query(models.Video).order_by(models.Video.order).all()
-        return {"videos": [
-            {
-                "id": video.id,
-                "title": video.title,
-                "artist": video.artist,
-                "type": video.type,
-                "youtube_url": video.youtube_url,
-                "thumbnail_url": video.thumbnail_url,
-                "order": video.order
-            } for video in videos
-        ]}
+        return await cached_response(request, ("videos", type_, artist), build)
     except Exception as e:
-        print(f"Error getting videos: {str(e)}")
+        logger.error(f"Error getting videos: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
-    finally:
-        db.close()
 
 # --- API для фотоальбомов ---
-@app.get("/photo-albums/", response_model=List[schemas.PhotoAlbumList])
+# Сериализация для кеша каталога (ответы отдаются готовыми байтами)
+photo_album_list_adapter = TypeAdapter(List[schemas.PhotoAlbumList])
+photo_album_adapter = TypeAdapter(schemas.PhotoAlbum)
+photo_album_summary_adapter = TypeAdapter(List[schemas.PhotoAlbumSummary])
+
+# Столбцы в порядке полей schemas.PhotoAlbumList / schemas.PhotoAlbum / schemas.AlbumImage
+# (быстрый путь отдает те же байты, см. fast_json.py)
+PHOTO_ALBUM_LIST_COLUMNS = (
+    models.PhotoAlbum.id,
+    models.PhotoAlbum.title,
+    models.PhotoAlbum.artist,
+    models.PhotoAlbum.type,
+    models.PhotoAlbum.preview_url,
+    models.PhotoAlbum.order,
+    models.PhotoAlbum.created_at,
+)
+PHOTO_ALBUM_COLUMNS = (
+    models.PhotoAlbum.title,
+    models.PhotoAlbum.artist,
+    models.PhotoAlbum.type,
+    models.PhotoAlbum.preview_url,
+    models.PhotoAlbum.order,
+    models.PhotoAlbum.id,
+    models.PhotoAlbum.created_at,
+)
+ALBUM_IMAGE_COLUMNS = (
+    models.AlbumImage.url,
+    models.AlbumImage.order,
+    models.AlbumImage.id,
+    models.AlbumImage.album_id,
+    models.AlbumImage.created_at,
+)
+
+async def attach_album_images(db: AsyncSession, albums: List[dict]):
+    """Изображения для страницы альбомов одним запросом (вместо selectinload)"""
+    by_album = {album["id"]: [] for album in albums}
+    if by_album:
+        result = await db.execute(
+            select(*ALBUM_IMAGE_COLUMNS)
+            .where(models.AlbumImage.album_id.in_(list(by_album)))
+            .order_by(models.AlbumImage.album_id, models.AlbumImage.order, models.AlbumImage.id)
+        )
+        for image in fast_json.rows(result):
+            by_album[image["album_id"]].append(image)
+    for album in albums:
+        album["images"] = by_album[album["id"]]
+
+async def photo_album_page(
+    db: AsyncSession,
+    view: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    offset: int = 0,
+    type_: Optional[str] = None,
+    artist: Optional[str] = None
+) -> Tuple[bytes, Optional[str]]:
+    """Страница списка альбомов (уже в JSON) и курсор следующей страницы"""
+    # NULL в order убраны миграцией, поэтому ключ - сам столбец и индекс (order, id)
+    order_key = models.PhotoAlbum.order
+    if view == "summary":
+        query = select(
+            models.PhotoAlbum.id,
+            models.PhotoAlbum.title,
+            models.PhotoAlbum.artist,
+            models.PhotoAlbum.type,
+            models.PhotoAlbum.preview_url,
+            order_key.label("order"),
+            models.PhotoAlbum.created_at,
+            # Коррелированный подзапрос вместо GROUP BY: страница берется по индексу (order, id),
+            # а количество считается по индексу album_images (album_id, ...)
+            select(func.count()).where(
+                models.AlbumImage.album_id == models.PhotoAlbum.id
+            ).scalar_subquery().label("image_count")
+        )
+    elif fast_json.ENABLED:
+        query = select(*PHOTO_ALBUM_LIST_COLUMNS)
+    else:
+        query = select(models.PhotoAlbum).options(selectinload(models.PhotoAlbum.images))
+
+    if type_ is not None:
+        query = query.where(models.PhotoAlbum.type == type_)
+    if artist is not None:
+        query = query.where(models.PhotoAlbum.artist == artist)
+    if cursor:
+        last_order, last_id = decode_cursor(cursor, 2)
+        query = query.where(tuple_(order_key, models.PhotoAlbum.id) > tuple_(last_order, last_id))
+    elif offset:
+        query = query.offset(offset)
+    query = query.order_by(order_key, models.PhotoAlbum.id).limit(limit + 1)
+
+    if fast_json.ENABLED:
+        rows = fast_json.rows(await db.execute(query))
+        page = rows[:limit]
+        if view == "full":
+            await attach_album_images(db, page)
+        body = fast_json.dumps(page)
+        last = (page[-1]["order"], page[-1]["id"]) if page else None
+    elif view == "summary":
+        rows = (await db.execute(query)).mappings().all()
+        page = photo_album_summary_adapter.validate_python(rows[:limit])
+        body = photo_album_summary_adapter.dump_json(page)
+        last = (page[-1].order, page[-1].id) if page else None
+    else:
+        rows = (await db.scalars(query)).all()
+        page = photo_album_list_adapter.validate_python(rows[:limit], from_attributes=True)
+        body = photo_album_list_adapter.dump_json(page)
+        last = (page[-1].order, page[-1].id) if page else None
+
+    next_cursor = encode_cursor(*last) if len(rows) > limit else None
+    return body, next_cursor
+
+async def photo_album_count(db: AsyncSession, type_: Optional[str] = None, artist: Optional[str] = None) -> int:
+    if type_ is not None and artist is None:
+        # Счетчик вкладки уже посчитан (см. facets.py)
+        return await facets.count(db, "album", type_)
+    query = select(func.count()).select_from(models.PhotoAlbum)
+    if type_ is not None:
+        query = query.where(models.PhotoAlbum.type == type_)
+    if artist is not None:
+        query = query.where(models.PhotoAlbum.artist == artist)
+    return await db.scalar(query)
+
+@app.get(
+    "/photo-albums/",
+    response_model=Union[List[schemas.PhotoAlbumList], List[schemas.PhotoAlbumSummary]]
+)
+@query_budget.budget(2)
 async def get_photo_albums(
-    limit: int = 10, 
-    offset: int = 0, 
-    db: Session = Depends(get_db)
+    request: Request,
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+    offset: int = Query(0, ge=0, deprecated=True),
+    view: str = Query("full", pattern="^(full|summary)$"),
+    type_: Optional[str] = Query(None, alias="type", max_length=100),
+    artist: Optional[str] = Query(None, max_length=200),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получение списка фотоальбомов с пагинацией"""
+    """Получение списка фотоальбомов с keyset-пагинацией по (order, id).
+
+    view=summary возвращает количество изображений вместо их списка.
+    type и artist фильтруют список (вкладки каталога).
+    Курсор следующей страницы передается в заголовке X-Next-Cursor.
+    """
+    async def build():
+        body, next_cursor = await photo_album_page(db, view, limit, cursor, offset, type_, artist)
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        return body, headers
+
     try:
-        albums = db.query(models.PhotoAlbum).order_by(models.PhotoAlbum.order).offset(offset).limit(limit).all()
-        return albums
+        return await cached_response(request, ("photo-albums", view, limit, cursor, offset, type_, artist), build)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при получении фотоальбомов: {str(e)}")
         raise HTTPException(status_code=500, detail="Ошибка при получении фотоальбомов")
 
 @app.get("/photo-albums/count/")
-async def get_photo_albums_count(db: Session = Depends(get_db)):
-    """Получение общего количества фотоальбомов"""
+@query_budget.budget(1)
+async def get_photo_albums_count(
+    request: Request,
+    type_: Optional[str] = Query(None, alias="type", max_length=100),
+    artist: Optional[str] = Query(None, max_length=200),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Получение количества фотоальбомов (всего или с фильтрами, как у списка)"""
+    async def build():
+        return json_bytes({"total": await photo_album_count(db, type_, artist)})
+
     try:
-        count = db.query(models.PhotoAlbum).count()
-        return {"total": count}
+        return await cached_response(request, ("photo-albums-count", type_, artist), build)
     except Exception as e:
         logger.error(f"Ошибка при получении количества альбомов: {str(e)}")
         raise HTTPException(status_code=500, detail="Ошибка при получении количества альбомов")
 
 @app.get("/photo-albums/{album_id}", response_model=schemas.PhotoAlbum)
-async def get_photo_album(album_id: int, db: Session = Depends(get_db)):
+@query_budget.budget(2)
+async def get_photo_album(album_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
     """Получение конкретного фотоальбома с изображениями"""
-    try:
-        album = db.query(models.PhotoAlbum).filter(models.PhotoAlbum.id == album_id).first()
+    async def build():
+        if fast_json.ENABLED:
+            albums = fast_json.rows(await db.execute(
+                select(*PHOTO_ALBUM_COLUMNS).where(models.PhotoAlbum.id == album_id)
+            ))
+            if not albums:
+                raise HTTPException(status_code=404, detail="Фотоальбом не найден")
+            await attach_album_images(db, albums)
+            return fast_json.dumps(albums[0])
+
+        album = await db.scalar(
+            select(models.PhotoAlbum)
+            .options(selectinload(models.PhotoAlbum.images))
+            .where(models.PhotoAlbum.id == album_id)
+        )
         if not album:
             raise HTTPException(status_code=404, detail="Фотоальбом не найден")
-        return album
+        return photo_album_adapter.dump_json(schemas.PhotoAlbum.model_validate(album))
+
+    try:
+        return await cached_response(request, ("photo-album", album_id), build)
     except HTTPException:
         raise
     except Exception as e:
@@ -562,6 +930,7 @@ async def get_photo_album(album_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Ошибка при получении фотоальбома")
 
 @app.post("/photo-albums/", response_model=schemas.PhotoAlbum)
+@query_budget.budget(8)
 async def create_photo_album(
     album: schemas.PhotoAlbumCreate,
     current_user: models.User = Depends(get_current_admin),
@@ -577,10 +946,10 @@ async def create_photo_album(
             order=album.order
         )
         db.add(db_album)
-        db.commit()
-        db.refresh(db_album)
+        db.flush()
         
-        # Добавляем изображения
+        # Добавляем изображения (в той же транзакции, что и альбом;
+        # ссылки на файлы хранилища учитывают триггеры, см. blobs.py)
         for i, image_url in enumerate(album.image_urls):
             db_image = models.AlbumImage(
                 album_id=db_album.id,
@@ -590,6 +959,7 @@ async def create_photo_album(
             db.add(db_image)
         
         db.commit()
+        catalog_cache.bump()
         db.refresh(db_album)
         return db_album
     except Exception as e:
@@ -598,6 +968,7 @@ async def create_photo_album(
         raise HTTPException(status_code=500, detail="Ошибка при создании фотоальбома")
 
 @app.put("/photo-albums/{album_id}", response_model=schemas.PhotoAlbum)
+@query_budget.budget(11)
 async def update_photo_album(
     album_id: int,
     album: schemas.PhotoAlbumCreate,
@@ -617,19 +988,13 @@ async def update_photo_album(
         db_album.preview_url = album.preview_url
         db_album.order = album.order
         
-        # Удаляем старые изображения
-        db.query(models.AlbumImage).filter(models.AlbumImage.album_id == album_id).delete()
-        
-        # Добавляем новые изображения
-        for i, image_url in enumerate(album.image_urls):
-            db_image = models.AlbumImage(
-                album_id=album_id,
-                url=image_url,
-                order=i
-            )
-            db.add(db_image)
-        
+        # Изображения меняем по разнице: неизменные строки сохраняют свои id
+        current = album_images.current_images(db, album_id)
+        album_images.apply_images(
+            db, album_id, current, album_images.desired_from_urls(current, album.image_urls)
+        )
         db.commit()
+        catalog_cache.bump()
         db.refresh(db_album)
         return db_album
     except HTTPException:
@@ -639,7 +1004,66 @@ async def update_photo_album(
         db.rollback()
         raise HTTPException(status_code=500, detail="Ошибка при обновлении фотоальбома")
 
+def _change_album_images(db: Session, album_id: int, build_desired) -> schemas.PhotoAlbum:
+    """Изменение изображений альбома одной транзакцией; выполняется в пуле потоков"""
+    try:
+        db_album = db.query(models.PhotoAlbum).filter(models.PhotoAlbum.id == album_id).first()
+        if not db_album:
+            raise HTTPException(status_code=404, detail="Фотоальбом не найден")
+        current = album_images.current_images(db, album_id)
+        changes = album_images.apply_images(db, album_id, current, build_desired(current))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    if any(changes.values()):
+        catalog_cache.bump()
+    db.refresh(db_album)
+    # Ответ собирается здесь же: ленивая загрузка images тоже не должна идти в event loop
+    return schemas.PhotoAlbum.model_validate(db_album)
+
+@app.patch("/photo-albums/{album_id}/images", response_model=schemas.PhotoAlbum)
+@query_budget.budget(9)
+async def patch_album_images(
+    album_id: int,
+    patch: schemas.AlbumImagesPatch,
+    current_user: models.User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    """Добавление, удаление и перестановка изображений альбома (только для администраторов)"""
+    try:
+        return await run_in_threadpool(
+            _change_album_images, db, album_id,
+            lambda current: album_images.desired_from_patch(current, patch.add, patch.remove, patch.order)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка при изменении изображений альбома: {str(e)}")
+        raise HTTPException(status_code=500, detail="Ошибка при изменении изображений альбома")
+
+@app.put("/photo-albums/{album_id}/images", response_model=schemas.PhotoAlbum)
+@query_budget.budget(9)
+async def replace_album_images(
+    album_id: int,
+    replacement: schemas.AlbumImagesReplace,
+    current_user: models.User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
+):
+    """Замена списка изображений альбома с сохранением id неизменных (только для администраторов)"""
+    try:
+        return await run_in_threadpool(
+            _change_album_images, db, album_id,
+            lambda current: album_images.desired_from_urls(current, replacement.image_urls)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка при замене изображений альбома: {str(e)}")
+        raise HTTPException(status_code=500, detail="Ошибка при замене изображений альбома")
+
 @app.delete("/photo-albums/{album_id}")
+@query_budget.budget(5)
 async def delete_photo_album(
     album_id: int,
     current_user: models.User = Depends(get_current_admin),
@@ -653,6 +1077,7 @@ async def delete_photo_album(
         
         db.delete(db_album)
         db.commit()
+        catalog_cache.bump()
         return {"message": "Фотоальбом успешно удален"}
     except HTTPException:
         raise
@@ -661,35 +1086,141 @@ async def delete_photo_album(
         db.rollback()
         raise HTTPException(status_code=500, detail="Ошибка при удалении фотоальбома")
 
+@app.get("/catalog/facets/")
+@query_budget.budget(1)
+async def get_catalog_facets(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Типы видео и фотоальбомов с количеством (для вкладок)"""
+    async def build():
+        return json_bytes(await facets.read_facets(db))
+
+    try:
+        return await cached_response(request, ("catalog-facets",), build)
+    except Exception as e:
+        logger.error(f"Ошибка при получении типов каталога: {str(e)}")
+        raise HTTPException(status_code=500, detail="Ошибка при получении типов каталога")
+
+# --- Начальные данные страниц ---
+# Все, что страница запрашивает при открытии, одним ответом и в одной сессии БД
+# вместо цепочки запросов (каждый - отдельный round-trip до API).
+
+@app.get("/bootstrap/portfolio-photo/")
+@query_budget.budget(2)
+async def bootstrap_portfolio_photo(
+    request: Request,
+    limit: int = Query(10, ge=1, le=100),
+    type_: Optional[str] = Query(None, alias="type", max_length=100),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Первая страница альбомов (view=summary), курсор следующей и общее количество.
+
+    Заменяет /photo-albums/count/ + /photo-albums/?view=summary при загрузке
+    Portfolio-photo.html; следующие страницы - как раньше, по курсору.
+    """
+    async def build():
+        albums, next_cursor = await photo_album_page(db, "summary", limit, type_=type_)
+        total = await photo_album_count(db, type_)
+        # Страница уже сериализована - вставляется в ответ как есть
+        return b"".join((
+            b'{"albums":', albums,
+            b',"next_cursor":', json_bytes(next_cursor),
+            b',"total":', json_bytes(total), b"}"
+        ))
+
+    try:
+        return await cached_response(request, ("bootstrap-portfolio-photo", limit, type_), build)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка при получении данных страницы портфолио: {str(e)}")
+        raise HTTPException(status_code=500, detail="Ошибка при получении данных страницы")
+
+@app.get("/bootstrap/kurs/")
+@query_budget.budget(2)
+async def bootstrap_kurs(
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Пользователь и прогресс по урокам для Kurs.html (вместо /users/me/ + /progress/)"""
+    try:
+        return {
+            "user": user_payload(current_user),
+            "progress": await load_progress(db, current_user.id)
+        }
+    except Exception as e:
+        logger.error(f"Error getting course bootstrap: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="Ошибка при получении данных курса"
+        )
+
+# --- Поиск по каталогу ---
+@app.get("/search")
+@query_budget.budget(1)
+async def search_catalog(
+    q: str = Query(..., min_length=2, max_length=100),
+    kind: Optional[str] = Query(None, pattern="^(video|album)$"),
+    limit: int = Query(10, ge=1, le=50),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Поиск видео и фотоальбомов по названию, автору и типу (префиксный, для подсказок).
+
+    Результаты упорядочены по релевантности среди всех совпадений; kind ограничивает
+    поиск одним видом, next_cursor - курсор следующей страницы.
+    """
+    try:
+        after = None
+        if cursor:
+            rank, last_kind, last_id = decode_cursor(cursor, 3)
+            valid = isinstance(rank, (int, float)) and isinstance(last_id, int)
+            if not valid or last_kind not in ("video", "album"):
+                raise HTTPException(status_code=400, detail="Некорректный курсор")
+            after = (rank, last_kind, last_id)
+        items, last = await search.search(db, q, kind, limit, after)
+        return {"items": items, "next_cursor": encode_cursor(*last) if last else None}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка поиска: {str(e)}")
+        raise HTTPException(status_code=500, detail="Ошибка поиска")
+
 # --- Эндпоинты для загрузки файлов ---
+# Путь -> вид загрузки (определяет лимит размера)
+UPLOAD_ROUTES = {
+    "/upload-preview/": "previews",
+    "/upload-image/": "images",
+    "/upload-thumbnail/": "thumbnails",
+}
+
+# Тело multipart разбирается до вызова эндпоинта, поэтому лимит размера
+# проверяется на потоке receive, пока тело читается (см. uploads.py)
+app.add_middleware(uploads.UploadLimitMiddleware, routes=UPLOAD_ROUTES)
+
+async def store_image_upload(file: UploadFile, path: str, db: Session) -> dict:
+    # Файл без ссылок удалит сборщик мусора после льготного периода
+    stored = await uploads.save_upload(file, UPLOAD_ROUTES[path], db)
+    # Адаптивные варианты (WebP разных ширин и заглушка) для srcset
+    variants = await images.create_variants(stored.path, stored.url)
+    return {
+        "url": stored.url,
+        "filename": stored.filename,
+        "sha256": stored.sha256,
+        "size": stored.size,
+        "content_type": stored.content_type,
+        "deduplicated": stored.deduplicated,
+        **variants
+    }
+
 @app.post("/upload-preview/")
+@query_budget.budget(2)
 async def upload_preview(
     file: UploadFile = File(...),
-    current_user: models.User = Depends(get_current_admin)
+    current_user: models.User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
 ):
     """Загрузка превью изображения для фотоальбома"""
     try:
-        # Проверяем тип файла
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="Файл должен быть изображением")
-        
-        # Создаем папку для загрузок, если её нет
-        upload_dir = os.path.join(BASE_DIR, "static", "uploads", "previews")
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Генерируем уникальное имя файла
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"preview_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{current_user.id}{file_extension}"
-        file_path = os.path.join(upload_dir, unique_filename)
-        
-        # Сохраняем файл
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Возвращаем URL для доступа к файлу
-        file_url = f"/static/uploads/previews/{unique_filename}"
-        
-        return {"url": file_url, "filename": unique_filename}
+        return await store_image_upload(file, "/upload-preview/", db)
     except HTTPException:
         raise
     except Exception as e:
@@ -697,33 +1228,15 @@ async def upload_preview(
         raise HTTPException(status_code=500, detail="Ошибка при загрузке файла")
 
 @app.post("/upload-image/")
+@query_budget.budget(2)
 async def upload_image(
     file: UploadFile = File(...),
-    current_user: models.User = Depends(get_current_admin)
+    current_user: models.User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
 ):
     """Загрузка изображения для фотоальбома"""
     try:
-        # Проверяем тип файла
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="Файл должен быть изображением")
-        
-        # Создаем папку для загрузок, если её нет
-        upload_dir = os.path.join(BASE_DIR, "static", "uploads", "images")
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Генерируем уникальное имя файла
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"image_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{current_user.id}{file_extension}"
-        file_path = os.path.join(upload_dir, unique_filename)
-        
-        # Сохраняем файл
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Возвращаем URL для доступа к файлу
-        file_url = f"/static/uploads/images/{unique_filename}"
-        
-        return {"url": file_url, "filename": unique_filename}
+        return await store_image_upload(file, "/upload-image/", db)
     except HTTPException:
         raise
     except Exception as e:
@@ -731,41 +1244,94 @@ async def upload_image(
         raise HTTPException(status_code=500, detail="Ошибка при загрузке файла")
 
 @app.post("/upload-thumbnail/")
+@query_budget.budget(2)
 async def upload_thumbnail(
     file: UploadFile = File(...),
-    current_user: models.User = Depends(get_current_admin)
+    current_user: models.User = Depends(get_current_admin),
+    db: Session = Depends(get_db)
 ):
     """Загрузка превью для видео"""
     try:
-        # Проверяем тип файла
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="Файл должен быть изображением")
-        
-        # Создаем папку для загрузок, если её нет
-        upload_dir = os.path.join(BASE_DIR, "static", "uploads", "thumbnails")
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Генерируем уникальное имя файла
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"thumbnail_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{current_user.id}{file_extension}"
-        file_path = os.path.join(upload_dir, unique_filename)
-        
-        # Сохраняем файл
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Возвращаем URL для доступа к файлу
-        file_url = f"/static/uploads/thumbnails/{unique_filename}"
-        
-        return {"url": file_url, "filename": unique_filename}
+        return await store_image_upload(file, "/upload-thumbnail/", db)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Ошибка при загрузке превью: {str(e)}")
         raise HTTPException(status_code=500, detail="Ошибка при загрузке файла")
 
-app.mount("/", StaticFiles(directory=TEMPLATES_DIR, html=True), name="static")
-# Запуск сервера
+# Периодическая сборка мусора в хранилище файлов
+BLOB_GC_INTERVAL_SECONDS = int(os.getenv("BLOB_GC_INTERVAL_SECONDS", 3600))
+
+def run_blob_gc():
+    db = SessionLocal()
+    try:
+        return blobs.collect_garbage(db)
+    finally:
+        db.close()
+
+async def blob_gc_loop():
+    # Сборщик работает в одном воркере: первый захвативший блокировку держит ее
+    # до выхода, после его падения роль подхватит другой воркер
+    gc_lock = None
+    while True:
+        await asyncio.sleep(BLOB_GC_INTERVAL_SECONDS)
+        if gc_lock is None:
+            gc_lock = blobs.acquire_gc_lock()
+            if gc_lock is None:
+                continue
+        try:
+            await run_in_threadpool(run_blob_gc)
+        except Exception as e:
+            logger.error(f"Ошибка сборщика мусора: {str(e)}")
+
+@app.on_event("startup")
+async def start_catalog_version_watch():
+    app.state.catalog_version_task = asyncio.create_task(watch_catalog_version())
+
+@app.on_event("startup")
+async def start_blob_gc():
+    if BLOB_GC_INTERVAL_SECONDS > 0:
+        app.state.blob_gc_task = asyncio.create_task(blob_gc_loop())
+
+# Готовность для балансировщика (/health/ready): выставляется после старта,
+# снимается в начале остановки, чтобы на воркер перестали слать запросы
+@app.on_event("startup")
+async def mark_ready():
+    hasher.warm_up()
+    app.state.ready = True
+
+@app.on_event("shutdown")
+async def mark_stopping():
+    app.state.ready = False
+    app.state.stopping = True
+
+@app.on_event("shutdown")
+async def stop_image_pool():
+    await run_in_threadpool(images.shutdown)
+
+# Сжатие ответов (Brotli/gzip) поверх catch_exceptions_middleware, поэтому сжимаются и ответы
+# об ошибках; внутри метрик - http_response_size_bytes показывает размер на проводе
+app.add_middleware(compression.CompressionMiddleware)
+
+# Бюджет SQL-запросов на маршрут (см. @query_budget.budget); выключен, если QUERY_BUDGET_MODE=off
+app.add_middleware(query_budget.QueryBudgetMiddleware)
+
+# Добавляется последним, поэтому внешний: время и размер учитывают все остальные middleware
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Контекст запроса для логов (request_id, маршрут, пользователь) виден и в middleware выше
+app.add_middleware(log_config.RequestContextMiddleware)
+
+# Файлы хранилища неизменяемы (URL содержит хеш), кешируются браузером навсегда
+app.mount("/static/uploads/blobs", ImmutableStaticFiles(directory=blobs.BLOB_ROOT, check_dir=False), name="blobs")
+
+# Варианты картинок сайта из python images.py backfill (не под git)
+app.mount(images.VARIANTS_URL_PREFIX, StaticFiles(directory=images.VARIANTS_DIR, check_dir=False), name="variants")
+
+# Статика с предсжатыми копиями и отпечатками (см. static_assets.py)
+app.mount("/", CachedStaticFiles(directory=TEMPLATES_DIR, html=True), name="static")
+
+# Запуск сервера: один процесс для разработки, для продакшена - serve.py
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, workers=1)
\ No newline at end of file
@@ -0,0 +1,211 @@
+"""Метрики в формате Prometheus (/metrics).
+
+Собственный минимальный реестр без внешних зависимостей: счетчики, gauge и
+гистограммы с фиксированными корзинами. Запись - поиск корзины и пара
+инкрементов под неоспариваемой блокировкой; сборка текста выполняется только
+при запросе /metrics.
+
+MetricsMiddleware (чистый ASGI, без буферизации тела) для каждого запроса
+записывает время ответа, размер тела, статус, количество SQL-запросов и
+их суммарное время (через sql_metrics) с метками метода и шаблона маршрута
+(/photo-albums/{album_id}, а не конкретный URL).
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Iterable, Sequence
+
+from starlette.routing import Mount
+
+import sql_metrics
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # метки -> [счетчики корзин (последняя +Inf), сумма]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_number(float(bound))}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_number(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Функция, обновляющая значения перед выдачей (например, gauge из stats())"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    "http_requests_total", "Количество HTTP-запросов", ["method", "route", "status"]
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "Время ответа", ["method", "route"]
+))
+RESPONSE_BYTES = registry.register(Histogram(
+    "http_response_size_bytes", "Размер тела ответа", ["method", "route"], SIZE_BUCKETS
+))
+IN_FLIGHT = registry.register(Gauge(
+    "http_requests_in_flight", "Запросы, обрабатываемые сейчас"
+))
+SQL_QUERIES = registry.register(Histogram(
+    "db_queries_per_request", "Количество SQL-запросов на HTTP-запрос", ["method", "route"], QUERY_COUNT_BUCKETS
+))
+SQL_SECONDS = registry.register(Histogram(
+    "db_query_duration_seconds_per_request", "Суммарное время SQL на HTTP-запрос", ["method", "route"]
+))
+PASSWORD_HASH_SECONDS = registry.register(Histogram(
+    "password_hash_duration_seconds", "Время bcrypt (без ожидания в очереди)", ["operation"], HASH_BUCKETS
+))
+PASSWORD_HASH_WAIT_SECONDS = registry.register(Histogram(
+    "password_hash_wait_seconds", "Ожидание bcrypt в очереди пула", ["operation"], LATENCY_BUCKETS
+))
+PASSWORD_HASH_PENDING = registry.register(Gauge(
+    "password_hash_pending", "Операции bcrypt в пуле и очереди"
+))
+PASSWORD_HASH_REJECTED = registry.register(Counter(
+    "password_hash_rejected_total", "Отказы 503 из-за заполненной очереди bcrypt"
+))
+
+
+def route_label(scope) -> str:
+    """Шаблон маршрута; у смонтированной статики - префикс монтирования"""
+    route = scope.get("route")
+    if route is not None and not isinstance(route, Mount):
+        return route.path
+    if "endpoint" in scope:
+        return f"{scope.get('root_path', '')}/{{path}}"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            with sql_metrics.track() as queries:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            IN_FLIGHT.dec()
+            method, route = scope["method"], route_label(scope)
+            REQUESTS.inc(method, route, str(status))
+            REQUEST_SECONDS.observe(elapsed, method, route)
+            RESPONSE_BYTES.observe(size, method, route)
+            SQL_QUERIES.observe(queries.count, method, route)
+            SQL_SECONDS.observe(queries.seconds, method, route)
@@ -0,0 +1,108 @@
+"""Обновление схемы существующей базы.
+
+create_all() создает только недостающие таблицы: новые индексы и ограничения
+для уже существующих таблиц он не добавляет. Здесь собраны идемпотентные
+шаги, которые доводят старую базу (например, sql_app.db) до текущих моделей.
+
+prepare_database() - вся подготовка базы перед приемом запросов: create_all(),
+эти шаги и первичное заполнение агрегатов статистики. serve.py вызывает ее
+один раз до запуска воркеров, при запуске без него - main.py при импорте.
+Вручную:
+
+    python migrations.py
+"""
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+import blobs
+import catalog_cache
+import facets
+import models
+import search
+import stats
+
+logger = logging.getLogger(__name__)
+
+
+def _index_exists(connection: Connection, name: str) -> bool:
+    return connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"),
+        {"name": name}
+    ).first() is not None
+
+
+def _unique_user_progress(connection: Connection):
+    """Одна строка прогресса на (user_id, lesson_id)"""
+    if _index_exists(connection, "ux_user_progress_user_lesson"):
+        return
+    # Дубликаты схлопываются в строку с наименьшим id; урок считается пройденным,
+    # если пройден хотя бы в одной из них - так же его считает stats.rebuild_stats()
+    connection.execute(text("""
+        UPDATE user_progress
+        SET is_completed = (
+            SELECT MAX(COALESCE(d.is_completed, 0)) FROM user_progress AS d
+            WHERE d.user_id = user_progress.user_id AND d.lesson_id = user_progress.lesson_id
+        )
+        WHERE id IN (SELECT MIN(id) FROM user_progress GROUP BY user_id, lesson_id HAVING COUNT(*) > 1)
+    """))
+    removed = connection.execute(text("""
+        DELETE FROM user_progress
+        WHERE id NOT IN (SELECT MIN(id) FROM user_progress GROUP BY user_id, lesson_id)
+    """)).rowcount
+    if removed:
+        logger.info(f"Удалено дубликатов прогресса: {removed}")
+    connection.execute(text(
+        "CREATE UNIQUE INDEX ux_user_progress_user_lesson ON user_progress (user_id, lesson_id)"
+    ))
+
+
+def _not_null_order(connection: Connection):
+    """Ключ сортировки без NULL, чтобы keyset-запросы шли по индексу (order, id)"""
+    for table in ("video", "photo_albums", "album_images"):
+        connection.execute(text(f'UPDATE {table} SET "order" = 0 WHERE "order" IS NULL'))
+
+
+def _missing_indexes(connection: Connection):
+    """Индексы из моделей, которых нет в существующих таблицах"""
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            # checkfirst не видит индексы по выражениям (их не отражает SQLAlchemy)
+            if not _index_exists(connection, index.name):
+                index.create(connection)
+
+
+STEPS = [
+    _unique_user_progress,
+    _not_null_order,
+    _missing_indexes,
+    search.create_indexes,
+    facets.create_triggers,
+    stats.create_triggers,
+    blobs.create_triggers,
+    catalog_cache.create_triggers,
+]
+
+
+def upgrade(engine: Engine):
+    with engine.begin() as connection:
+        for step in STEPS:
+            step(connection)
+
+
+def prepare_database(engine: Engine):
+    """Схема, миграции и агрегаты статистики (идемпотентно)"""
+    models.Base.metadata.create_all(bind=engine)
+    upgrade(engine)
+    # Заполняем агрегаты статистики, если база создана до их появления
+    with Session(engine) as db:
+        stats.ensure_stats(db)
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    prepare_database(engine)
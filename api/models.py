@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, DateTime, collate, literal_column
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -15,6 +15,13 @@ class User(Base):
     date_reg = Column(String)  # Храним как строку в формате DD.MM.YYYY
     progress = relationship("UserProgress", back_populates="user")
 
+# Ключи /admin/users/ (main.get_users) и индексы по ним. Константы - литералами,
+# а не параметрами: иначе SQLite не сопоставит выражение запроса с индексом
+USERNAME_SORT_KEY = collate(func.coalesce(User.username, literal_column("''")), "NOCASE")
+ADMIN_FLAG = func.coalesce(User.is_admin, literal_column("0")) != literal_column("0")
+Index("ix_users_username_nocase_id", USERNAME_SORT_KEY, User.id)
+Index("ix_users_admin_id", ADMIN_FLAG, User.id)
+
 class UserProgress(Base):
     __tablename__ = "user_progress"
     id = Column(Integer, primary_key=True, index=True)
@@ -23,6 +30,10 @@ class UserProgress(Base):
     is_completed = Column(Integer, default=0)  # 0 = False, 1 = True
     user = relationship("User", back_populates="progress")
 
+    __table_args__ = (
+        Index("ux_user_progress_user_lesson", "user_id", "lesson_id", unique=True),
+    )
+
 class Video(Base):
     __tablename__ = "video"
 
@@ -35,6 +46,13 @@ class Video(Base):
     order = Column(Integer, default=0)  # для сортировки видео
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_video_order_id", "order", "id"),
+        # Вкладки по типу и фильтр по автору с той же сортировкой (order, id)
+        Index("ix_video_type_order_id", "type", "order", "id"),
+        Index("ix_video_artist_order_id", "artist", "order", "id"),
+    )
+
 class PhotoAlbum(Base):
     __tablename__ = "photo_albums"
     
@@ -47,7 +65,20 @@ class PhotoAlbum(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Связь с изображениями
-    images = relationship("AlbumImage", back_populates="album", cascade="all, delete-orphan")
+    images = relationship(
+        "AlbumImage",
+        back_populates="album",
+        cascade="all, delete-orphan",
+        # album_id первым: selectinload по нескольким альбомам (IN) идет по
+        # индексу (album_id, order, id) без сортировки; порядок внутри альбома тот же
+        order_by="[AlbumImage.album_id, AlbumImage.order, AlbumImage.id]"
+    )
+
+    __table_args__ = (
+        Index("ix_photo_albums_order_id", "order", "id"),
+        Index("ix_photo_albums_type_order_id", "type", "order", "id"),
+        Index("ix_photo_albums_artist_order_id", "artist", "order", "id"),
+    )
 
 class AlbumImage(Base):
     __tablename__ = "album_images"
@@ -59,4 +90,58 @@ class AlbumImage(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Связь с альбомом
-    album = relationship("PhotoAlbum", back_populates="images")
\ No newline at end of file
+    album = relationship("PhotoAlbum", back_populates="images")
+
+    __table_args__ = (
+        Index("ix_album_images_album_order", "album_id", "order", "id"),
+    )
+
+class StatsRollup(Base):
+    """Агрегаты для /admin/stats/, обновляются инкрементально вместе с данными"""
+    __tablename__ = "stats_rollup"
+
+    key = Column(String, primary_key=True)  # users, admins, completed, lesson:<id>
+    value = Column(Integer, nullable=False, default=0)
+
+class CatalogFacet(Base):
+    """Количество видео и альбомов по типу, поддерживается триггерами (см. facets.py)"""
+    __tablename__ = "catalog_facets"
+
+    kind = Column(String, primary_key=True)  # video, album
+    type = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class CatalogVersion(Base):
+    """Счетчик изменений каталога (одна строка), увеличивается триггерами (см. catalog_cache.py)"""
+    __tablename__ = "catalog_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class UserStats(Base):
+    """Счетчик пройденных уроков пользователя (строка есть у каждого пользователя)"""
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    completed_lessons = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Сортировка /admin/users/ по прогрессу идет по индексу
+        Index("ix_user_stats_completed_user", "completed_lessons", "user_id"),
+    )
+
+class Blob(Base):
+    """Загруженный файл, хранящийся по хешу содержимого"""
+    __tablename__ = "blobs"
+
+    sha256 = Column(String, primary_key=True)
+    extension = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    content_type = Column(String, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)  # ссылки из альбомов, изображений и видео
+    unreferenced_since = Column(DateTime, nullable=True)  # когда ссылок стало 0 (для сборщика мусора)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_blobs_unreferenced_since", "unreferenced_since"),
+    )
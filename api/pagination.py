@@ -0,0 +1,30 @@
+import base64
+import json
+
+from fastapi import HTTPException
+
+
+# Курсор keyset-пагинации: значения ключа сортировки последней строки страницы,
+# упакованные в base64url, чтобы клиент передавал их как непрозрачную строку
+def encode_cursor(*values) -> str:
+    raw = json.dumps(list(values), ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    # В SQL-сравнение попадают только скаляры: объект или список дал бы 500
+    if not all(value is None or isinstance(value, (str, int, float)) for value in values):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    return values
+
+
+def escape_like(value: str) -> str:
+    """Экранирование спецсимволов для LIKE ... ESCAPE '\\'"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
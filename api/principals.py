@@ -0,0 +1,80 @@
+"""Кеш аутентифицированных пользователей для get_current_user.
+
+Ключ - subject токена (username). Запись живет не дольше PRINCIPAL_CACHE_TTL
+секунд, кеш ограничен PRINCIPAL_CACHE_SIZE записями (LRU). Эндпоинты, которые
+меняют пользователя, вызывают invalidate() после коммита.
+
+Кеш у каждого воркера свой, поэтому invalidate() сбрасывает его целиком и
+перезаписывает файл версии рядом с БД (version_file.py): остальные воркеры
+видят изменение при следующем get() и тоже сбрасывают кеш, так что
+отозванные права не переживают изменение ни в одном процессе. Пользователи
+меняются редко, поэтому полный сброс дешевле учета отдельных записей.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import models
+from database import DATABASE_PATH
+from version_file import VersionFile
+
+
+class PrincipalCache:
+    def __init__(self, max_size: int, ttl: float, version_file: str):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version_file = VersionFile(version_file)
+        self.version = 0
+        self._entries = OrderedDict()  # username -> (expires_at, user)
+        self._lock = threading.Lock()
+
+    def _reset(self):
+        self.version += 1
+        self._entries.clear()
+
+    def get(self, username: str) -> Optional[models.User]:
+        with self._lock:
+            # Изменение пользователя в другом воркере
+            if self.version_file.changed():
+                self._reset()
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._entries[username]
+                return None
+            self._entries.move_to_end(username)
+            return user
+
+    def put(self, username: str, user: models.User, version: int):
+        """version - значение self.version до чтения пользователя из БД"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            # Прочитан до invalidate() - мог устареть
+            if version != self.version:
+                return
+            self._entries[username] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Сброс во всех воркерах (после изменения любого пользователя)"""
+        with self._lock:
+            self._reset()
+            self.version_file.touch()
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+
+principal_cache = PrincipalCache(
+    max_size=int(os.getenv("PRINCIPAL_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL", 30)),
+    version_file=os.getenv("PRINCIPAL_VERSION_FILE", f"{DATABASE_PATH}.principals-version"),
+)
@@ -0,0 +1,75 @@
+"""Бюджет SQL-запросов на HTTP-запрос.
+
+Эндпоинт объявляет, сколько SQL-запросов ему нужно:
+
+    @app.get("/photo-albums/")
+    @query_budget.budget(2)
+    async def get_photo_albums(...):
+
+Для остальных маршрутов действует QUERY_BUDGET_DEFAULT. Блок кода
+(в скрипте или тесте) можно ограничить так же:
+
+    with query_budget.expect(3):
+        ...
+
+Режим задается QUERY_BUDGET_MODE:
+    off    - проверки нет (по умолчанию, продакшен);
+    log    - превышение пишется в лог со списком запросов и местами вызова (стенд);
+    strict - как log, плюс QueryBudgetExceeded (тесты, query_plans.py).
+"""
+import logging
+import os
+from contextlib import contextmanager
+
+import sql_metrics
+
+logger = logging.getLogger(__name__)
+
+MODE = os.getenv("QUERY_BUDGET_MODE", "off")
+DEFAULT_BUDGET = int(os.getenv("QUERY_BUDGET_DEFAULT", 20))
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def budget(max_queries: int):
+    """Декоратор эндпоинта: допустимое количество SQL-запросов"""
+    def decorator(endpoint):
+        endpoint.query_budget = max_queries
+        return endpoint
+    return decorator
+
+
+def _check(name: str, max_queries: int, queries: sql_metrics.QueryStats):
+    if queries.count <= max_queries:
+        return
+    lines = "\n".join(f"  {site}: {statement[:200]}" for statement, site in queries.statements)
+    message = f"{name}: {queries.count} SQL-запросов при бюджете {max_queries}"
+    logger.warning(f"{message}\n{lines}")
+    if MODE == "strict":
+        raise QueryBudgetExceeded(message)
+
+
+@contextmanager
+def expect(max_queries: int, name: str = "block"):
+    with sql_metrics.track(record=True) as queries:
+        yield queries
+    _check(name, max_queries, queries)
+
+
+class QueryBudgetMiddleware:
+    """Проверка бюджета маршрута после обработки запроса (при MODE != off)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if MODE == "off" or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with sql_metrics.track(record=True) as queries:
+            await self.app(scope, receive, send)
+        endpoint = scope.get("endpoint")
+        max_queries = getattr(endpoint, "query_budget", DEFAULT_BUDGET)
+        _check(f"{scope['method']} {scope['path']}", max_queries, queries)
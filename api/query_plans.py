@@ -0,0 +1,272 @@
+"""Проверка планов запросов.
+
+Поднимает приложение на временной базе с тестовыми данными, вызывает
+эндпоинты и для каждого выполненного SQL-запроса снимает EXPLAIN QUERY PLAN.
+Если в плане есть полный проход по таблице (SCAN без индекса) или
+сортировка во временном B-дереве (USE TEMP B-TREE FOR ORDER BY - страница
+строится сортировкой всех подходящих строк, а не чтением индекса), проверка
+завершается с кодом 1:
+
+    python query_plans.py       # только ошибки
+    python query_plans.py -v    # планы всех запросов
+
+Проход или сортировка, которые неизбежны, разрешаются явно в наборе
+конкретного сценария (имя таблицы или TEMP_SORT).
+
+Заодно проверяются бюджеты SQL-запросов маршрутов (QUERY_BUDGET_MODE=strict,
+см. query_budget.py): кеши сбрасываются перед каждым сценарием, поэтому
+количество запросов - худший случай.
+"""
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+# База должна быть задана до импорта database/main
+_workdir = tempfile.mkdtemp(prefix="query-plans-")
+os.environ["DATABASE_PATH"] = os.path.join(_workdir, "plans.db")
+os.environ.setdefault("QUERY_BUDGET_MODE", "strict")
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+import blobs  # noqa: E402
+import main  # noqa: E402
+import models  # noqa: E402
+import query_budget  # noqa: E402
+from catalog_cache import catalog_cache  # noqa: E402
+from database import DATABASE_PATH, SessionLocal, async_engine, engine  # noqa: E402
+from hashing import get_pwd_context  # noqa: E402
+from principals import principal_cache  # noqa: E402
+
+PASSWORD = "plans"
+FULL_SCAN_RE = re.compile(r"^SCAN (\w+)$")
+MATERIALIZE_RE = re.compile(r"^MATERIALIZE (\w+)$")
+TEMP_SORT = "USE TEMP B-TREE FOR ORDER BY"
+
+# Таблицы, которые читаются целиком по смыслу и остаются маленькими
+ALLOWED_FULL_SCANS = {
+    "stats_rollup": "десятки строк агрегатов, /admin/stats/ читает их все",
+    "catalog_facets": "по строке на тип видео или альбома, /catalog/facets/ читает их все",
+}
+
+
+def seed():
+    """Небольшой набор данных, чтобы запросы возвращали строки"""
+    db = SessionLocal()
+    try:
+        admin = models.User(
+            username="admin", first_name="A", last_name="A",
+            hashed_password=get_pwd_context().hash(PASSWORD), is_admin=1, date_reg="01.01.2024"
+        )
+        db.add(admin)
+        for i in range(20):
+            user = models.User(
+                username=f"user{i:02d}", first_name="U", last_name="U",
+                hashed_password=admin.hashed_password, is_admin=0, date_reg="01.01.2024"
+            )
+            db.add(user)
+            db.flush()
+            for lesson_id in range(1, i % 12 + 1):
+                db.add(models.UserProgress(user_id=user.id, lesson_id=lesson_id, is_completed=1))
+        for i in range(10):
+            db.add(models.Video(
+                title=f"Video {i}", artist="Artist", type="Сниппет",
+                youtube_url="https://youtu.be/x", thumbnail_url="/thumb.jpg", order=i
+            ))
+            album = models.PhotoAlbum(title=f"Album {i}", artist="Artist", type="Каталог", preview_url="/p.jpg", order=i)
+            album.images = [models.AlbumImage(url=f"/img{i}-{n}.jpg", order=n) for n in range(5)]
+            db.add(album)
+        db.commit()
+    finally:
+        db.close()
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")):
+            params = parameters
+            if executemany and parameters and isinstance(parameters[0], (list, tuple)):
+                params = parameters[0]
+            self.queries.append((statement, tuple(params or ())))
+
+
+def explain(connection: sqlite3.Connection, statement: str, params: tuple) -> list:
+    return [row[3] for row in connection.execute("EXPLAIN QUERY PLAN " + statement, params)]
+
+
+def plan_problems(plan: list, allowed: set) -> list:
+    problems = [f"полный проход: {table}" for table in full_scans(plan, allowed)]
+    if TEMP_SORT in plan and TEMP_SORT not in allowed:
+        problems.append("сортировка во временном B-дереве")
+    return problems
+
+
+def full_scans(plan: list, allowed: set) -> list:
+    # Проход по материализованному подзапросу - это проход по его результату
+    # (например, LIMIT из FTS), а не по таблице
+    materialized = {match.group(1) for match in map(MATERIALIZE_RE.match, plan) if match}
+    allowed = allowed | materialized
+    scans = []
+    for detail in plan:
+        match = FULL_SCAN_RE.match(detail)
+        if match and match.group(1) not in allowed and match.group(1) not in ALLOWED_FULL_SCANS:
+            scans.append(match.group(1))
+    return scans
+
+
+def cases(client: TestClient, headers: dict) -> list:
+    """(название, вызов, разрешенные полные проходы и сортировки)"""
+    # Идентификаторы и курсоры берутся заранее, чтобы их запросы не попали в сценарии
+    album_id = client.get("/photo-albums/?limit=1").json()[0]["id"]
+    albums_cursor = client.get("/photo-albums/?limit=3").headers["X-Next-Cursor"]
+    users = client.get("/admin/users/?limit=5", headers=headers).json()
+    user_id = users["users"][-1]["id"]
+    users_cursor = users["next_cursor"]
+    username_cursor = client.get("/admin/users/?limit=5&sort=username", headers=headers).json()["next_cursor"]
+    username_desc_cursor = client.get(
+        "/admin/users/?limit=5&sort=username&order=desc", headers=headers).json()["next_cursor"]
+
+    album = {"title": "New", "artist": "Artist", "type": "Промо к релизу", "preview_url": "/p.jpg", "order": 3,
+             "image_urls": ["/a.jpg", "/b.jpg", "/c.jpg"]}
+    new_user = {"first_name": "N", "last_name": "N", "username": "plans-new", "password": PASSWORD}
+    return [
+        ("POST /register/", lambda: client.post("/register/", json=new_user), set()),
+        ("POST /admin/create/", lambda: client.post(
+            "/admin/create/", json={**new_user, "username": "plans-admin"}, headers=headers), set()),
+        ("POST /token", lambda: client.post("/token", data={"username": "admin", "password": PASSWORD}), set()),
+        ("GET /users/me/", lambda: client.get("/users/me/", headers=headers), set()),
+        ("GET /progress/", lambda: client.get("/progress/", headers=headers), set()),
+        ("GET /bootstrap/kurs/", lambda: client.get("/bootstrap/kurs/", headers=headers), set()),
+        ("POST /progress/", lambda: client.post(
+            "/progress/", json={"lesson_id": 1, "is_completed": True}, headers=headers), set()),
+        ("POST /progress/batch", lambda: client.post("/progress/batch", json={"items": [
+            {"lesson_id": 2, "is_completed": True}, {"lesson_id": 1, "is_completed": False}
+        ]}, headers=headers), set()),
+        ("GET /admin/users/", lambda: client.get("/admin/users/?limit=5", headers=headers), set()),
+        ("GET /admin/users/ (cursor)", lambda: client.get(
+            f"/admin/users/?limit=5&cursor={users_cursor}", headers=headers), set()),
+        ("GET /admin/users/ (sort=progress)", lambda: client.get(
+            "/admin/users/?limit=5&sort=progress&order=desc&is_admin=false", headers=headers), set()),
+        ("GET /admin/users/ (sort=username)", lambda: client.get(
+            "/admin/users/?limit=5&sort=username", headers=headers), set()),
+        ("GET /admin/users/ (sort=username, cursor)", lambda: client.get(
+            f"/admin/users/?limit=5&sort=username&cursor={username_cursor}", headers=headers), set()),
+        ("GET /admin/users/ (sort=username desc, cursor)", lambda: client.get(
+            f"/admin/users/?limit=5&sort=username&order=desc&cursor={username_desc_cursor}", headers=headers), set()),
+        # Сортируются только логины с префиксом (поиск по диапазону индекса логина)
+        ("GET /admin/users/ (username)", lambda: client.get(
+            "/admin/users/?limit=5&username=USER1", headers=headers), {TEMP_SORT}),
+        ("GET /admin/users/ (username, sort=username)", lambda: client.get(
+            "/admin/users/?limit=5&username=USER1&sort=username", headers=headers), set()),
+        ("GET /admin/users/ (is_admin=true)", lambda: client.get(
+            "/admin/users/?limit=5&is_admin=true", headers=headers), set()),
+        ("GET /admin/stats/", lambda: client.get("/admin/stats/", headers=headers), set()),
+        ("GET /users/{id}", lambda: client.get(f"/users/{user_id}", headers=headers), set()),
+        ("PUT /users/{id}", lambda: client.put(
+            f"/users/{user_id}", json={"first_name": "X", "last_name": "Y", "username": "plans-renamed", "password": ""},
+            headers=headers), set()),
+        ("POST /users/{id}/toggle-admin", lambda: client.post(
+            f"/users/{user_id}/toggle-admin", json={"is_admin": True}, headers=headers), set()),
+        ("DELETE /users/{id}", lambda: client.delete(f"/users/{user_id}", headers=headers), set()),
+        ("GET /videos/", lambda: client.get("/videos/"), set()),
+        ("GET /videos/ (type)", lambda: client.get("/videos/?type=Сниппет"), set()),
+        ("GET /videos/ (artist)", lambda: client.get("/videos/?artist=Artist"), set()),
+        ("GET /videos/{id}", lambda: client.get("/videos/1", headers=headers), set()),
+        ("GET /photo-albums/", lambda: client.get("/photo-albums/?limit=3"), set()),
+        ("GET /photo-albums/ (cursor)", lambda: client.get(
+            f"/photo-albums/?limit=3&cursor={albums_cursor}"), set()),
+        ("GET /photo-albums/ (summary)", lambda: client.get("/photo-albums/?limit=3&view=summary"), set()),
+        ("GET /photo-albums/ (type)", lambda: client.get(
+            f"/photo-albums/?limit=3&type=Каталог&cursor={albums_cursor}"), set()),
+        ("GET /photo-albums/ (artist, summary)", lambda: client.get(
+            "/photo-albums/?limit=3&artist=Artist&view=summary"), set()),
+        ("GET /photo-albums/count/", lambda: client.get("/photo-albums/count/"), set()),
+        ("GET /photo-albums/count/ (type)", lambda: client.get("/photo-albums/count/?type=Каталог"), set()),
+        ("GET /photo-albums/count/ (artist)", lambda: client.get("/photo-albums/count/?artist=Artist"), set()),
+        ("GET /catalog/facets/", lambda: client.get("/catalog/facets/"), set()),
+        ("GET /bootstrap/portfolio-photo/", lambda: client.get("/bootstrap/portfolio-photo/?limit=3"), set()),
+        ("GET /bootstrap/portfolio-photo/ (type)", lambda: client.get(
+            "/bootstrap/portfolio-photo/?limit=3&type=Каталог"), set()),
+        ("GET /photo-albums/{id}", lambda: client.get(f"/photo-albums/{album_id}"), set()),
+        # Ранг bm25 вычисляется по совпадениям, индекса по нему нет
+        ("GET /search", lambda: client.get("/search?q=art%20vid"), {TEMP_SORT}),
+        ("GET /search (kind)", lambda: client.get("/search?q=alb&kind=album"), {TEMP_SORT}),
+        ("POST /photo-albums/", lambda: client.post("/photo-albums/", json=album, headers=headers), set()),
+        ("PUT /photo-albums/{id}", lambda: client.put(
+            f"/photo-albums/{album_id}", json={**album, "image_urls": ["/c.jpg", "/a.jpg"]}, headers=headers), set()),
+        ("PATCH /photo-albums/{id}/images", lambda: client.patch(
+            f"/photo-albums/{album_id}/images", json={"add": ["/d.jpg"]}, headers=headers), set()),
+        ("PUT /photo-albums/{id}/images", lambda: client.put(
+            f"/photo-albums/{album_id}/images", json={"image_urls": ["/d.jpg", "/c.jpg"]}, headers=headers), set()),
+        ("DELETE /photo-albums/{id}", lambda: client.delete(f"/photo-albums/{album_id}", headers=headers), set()),
+        ("blobs.collect_garbage", lambda: _run_with_session(blobs.collect_garbage), set()),
+    ]
+
+
+def _run_with_session(function):
+    db = SessionLocal()
+    try:
+        return function(db)
+    finally:
+        db.close()
+
+
+def run(verbose: bool = False) -> int:
+    seed()
+    client = TestClient(main.app)
+    token = client.post("/token", data={"username": "admin", "password": PASSWORD}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    recorder = QueryRecorder()
+    connection = sqlite3.connect(DATABASE_PATH)
+    failures = 0
+    for name, call, allowed in cases(client, headers):
+        # Кеши сбрасываются, чтобы запросы действительно дошли до базы
+        catalog_cache.bump()
+        principal_cache.clear()
+        recorder.queries.clear()
+        for target in (engine, async_engine.sync_engine):
+            event.listen(target, "before_cursor_execute", recorder)
+        try:
+            response = call()
+        except query_budget.QueryBudgetExceeded as e:
+            print(f"FAIL {name}: {e}")
+            failures += 1
+            continue
+        finally:
+            for target in (engine, async_engine.sync_engine):
+                event.remove(target, "before_cursor_execute", recorder)
+        status = getattr(response, "status_code", 200)
+
+        problems = []
+        for statement, params in dict.fromkeys(recorder.queries):
+            plan = explain(connection, statement, params)
+            found = plan_problems(plan, allowed)
+            if found or verbose:
+                problems.append((statement, plan, found))
+        failed = status >= 400 or any(found for _, _, found in problems)
+        failures += failed
+        print(f"{'FAIL' if failed else 'ok  '} {name} ({len(recorder.queries)} запросов, HTTP {status})")
+        for statement, plan, found in problems:
+            if found:
+                print(f"     {'; '.join(found)}")
+            print("     " + " ".join(statement.split()))
+            for detail in plan:
+                print(f"       {detail}")
+    connection.close()
+    print(f"Сценариев с ошибками: {failures}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    try:
+        code = run(verbose="-v" in sys.argv[1:])
+    finally:
+        shutil.rmtree(_workdir, ignore_errors=True)
+    sys.exit(code)
@@ -27,6 +27,14 @@ class AlbumImage(AlbumImageBase):
     class Config:
         from_attributes = True
 
+class AlbumImagesReplace(BaseModel):
+    image_urls: List[str]
+
+class AlbumImagesPatch(BaseModel):
+    add: List[str] = []  # URL новых изображений (добавляются в конец)
+    remove: List[int] = []  # id удаляемых изображений
+    order: List[int] = []  # id в новом порядке; неперечисленные остаются после них
+
 class PhotoAlbumBase(BaseModel):
     title: str
     artist: str
@@ -56,4 +64,18 @@ class PhotoAlbumList(BaseModel):
     images: List[AlbumImage] = []
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class PhotoAlbumSummary(BaseModel):
+    """Альбом для сетки галереи: без списка изображений, только их количество"""
+    id: int
+    title: str
+    artist: str
+    type: str
+    preview_url: str
+    order: int
+    created_at: datetime
+    image_count: int
+
+    class Config:
+        from_attributes = True
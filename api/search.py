@@ -0,0 +1,173 @@
+"""Полнотекстовый поиск по каталогу (SQLite FTS5).
+
+Индексы video_search и photo_album_search - таблицы FTS5 с внешним
+содержимым (content=video / photo_albums): сам текст хранится только в
+исходных таблицах, в индексе - токены. Синхронизацию делают триггеры на
+INSERT, DELETE и UPDATE OF title, artist, type, поэтому индекс меняется в той
+же транзакции, что и строка, при любом способе записи (эндпоинты альбомов,
+ручное наполнение видео). Перестановка (order) индекс не трогает.
+
+Запрос пользователя разбивается на слова, каждое ищется как префикс
+("мар" находит "Марина"), все слова обязательны. Порядок - bm25 с весами
+title > artist > type по всем совпадениям, без окна по новизне: короткий
+префикс или тип ("клип") совпадает с третью каталога, и такой запрос стоит
+10-25 мс на 35 тыс. записей, зато более релевантные старые записи не теряются.
+Следующие страницы - keyset-курсор по (rank, kind, id) последнего результата.
+
+Создание индексов и заполнение для существующей базы - шаг migrations.py.
+"""
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+MAX_TERMS = 8
+
+# Веса столбцов bm25: title, artist, type
+RANK_FUNCTION = "bm25(10.0, 5.0, 1.0)"
+
+# Индекс -> (таблица-источник, столбец изображения, тип результата)
+INDEXES = {
+    "video_search": ("video", "thumbnail_url", "video"),
+    "photo_album_search": ("photo_albums", "preview_url", "album"),
+}
+
+_TERM_RE = re.compile(r"\w+")
+
+
+def _index_ddl(name: str, source: str) -> List[str]:
+    columns = "title, artist, type"
+    old = "old.id, old.title, old.artist, old.type"
+    new = "new.id, new.title, new.artist, new.type"
+    return [
+        f"""CREATE VIRTUAL TABLE {name} USING fts5(
+            {columns}, content='{source}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {source} BEGIN
+            INSERT INTO {name}(rowid, {columns}) VALUES ({new});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {source} BEGIN
+            INSERT INTO {name}({name}, rowid, {columns}) VALUES ('delete', {old});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE OF title, artist, type ON {source} BEGIN
+            INSERT INTO {name}({name}, rowid, {columns}) VALUES ('delete', {old});
+            INSERT INTO {name}(rowid, {columns}) VALUES ({new});
+        END""",
+        f"INSERT INTO {name}({name}, rank) VALUES ('rank', '{RANK_FUNCTION}')",
+        # Заполнение из уже существующих строк
+        f"INSERT INTO {name}({name}) VALUES ('rebuild')",
+    ]
+
+
+def create_indexes(connection: Connection):
+    """Индексы и триггеры, если их еще нет (шаг миграции)"""
+    for name, (source, _, _) in INDEXES.items():
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": name}
+        ).first() is not None
+        if exists:
+            continue
+        for statement in _index_ddl(name, source):
+            connection.execute(text(statement))
+
+
+def rebuild_indexes(connection: Connection):
+    """Полная перестройка (после ручной правки данных в обход триггеров)"""
+    for name in INDEXES:
+        connection.execute(text(f"INSERT INTO {name}({name}) VALUES ('rebuild')"))
+
+
+def match_expression(query: str) -> Optional[str]:
+    """Строка пользователя -> выражение MATCH; None, если слов нет.
+
+    Слова берутся в кавычки, поэтому синтаксис FTS5 (NEAR, OR, *, ^) из
+    пользовательского ввода не интерпретируется.
+    """
+    terms = _TERM_RE.findall(query.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def _after(kind: str, cursor_kind: str) -> str:
+    """Условие "после курсора" для индекса вида kind.
+
+    Вид в ветке - константа, поэтому сравнение тройки (rank, kind, id)
+    сводится к условию на rank и rowid самого индекса.
+    """
+    if kind > cursor_kind:
+        return "rank >= :rank"
+    if kind < cursor_kind:
+        return "rank > :rank"
+    return "(rank > :rank OR (rank = :rank AND rowid > :id))"
+
+
+def _branch(name: str, cursor_kind: Optional[str]) -> str:
+    source, image_column, kind = INDEXES[name]
+    after = f" AND {_after(kind, cursor_kind)}" if cursor_kind is not None else ""
+    return f"""
+        SELECT '{kind}' AS kind, item.id, item.title, item.artist, item.type,
+               item.{image_column} AS image_url, hit.rank
+        FROM (
+            SELECT rowid, rank FROM {name}
+            WHERE {name} MATCH :match{after}
+            ORDER BY rank, rowid LIMIT :limit
+        ) AS hit
+        JOIN {source} AS item ON item.id = hit.rowid
+    """
+
+
+async def search(
+    db: AsyncSession,
+    query: str,
+    kind: Optional[str] = None,
+    limit: int = 10,
+    after: Optional[Tuple[float, str, int]] = None
+) -> Tuple[List[dict], Optional[Tuple[float, str, int]]]:
+    """Страница совпадений из видео и/или альбомов по убыванию релевантности.
+
+    after - (rank, kind, id) последнего результата предыдущей страницы.
+    Возвращает результаты и такой же ключ для следующей страницы (None, если
+    страница последняя).
+    """
+    match = match_expression(query)
+    if match is None:
+        return [], None
+    names = [name for name, (_, _, index_kind) in INDEXES.items() if kind in (None, index_kind)]
+    cursor_kind = after[1] if after is not None else None
+    statement = " UNION ALL ".join(_branch(name, cursor_kind) for name in names)
+    params = {"match": match, "limit": limit + 1}
+    if after is not None:
+        params.update(rank=after[0], id=after[2])
+    result = await db.execute(
+        text(
+            "SELECT kind, id, title, artist, type, image_url, rank "
+            f"FROM ({statement}) ORDER BY rank, kind, id LIMIT :limit"
+        ),
+        params
+    )
+    rows = [dict(row) for row in result.mappings()]
+    last = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = (rows[-1]["rank"], rows[-1]["kind"], rows[-1]["id"])
+    for row in rows:
+        del row["rank"]
+    return rows, last
+
+
+if __name__ == "__main__":
+    import sys
+
+    from database import engine
+
+    if sys.argv[1:] != ["rebuild"]:
+        print("Использование: python search.py rebuild")
+        sys.exit(1)
+    with engine.begin() as connection:
+        rebuild_indexes(connection)
+    print("Поисковые индексы перестроены")
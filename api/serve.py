@@ -0,0 +1,62 @@
+"""Запуск в продакшене: несколько воркеров uvicorn на одном порту.
+
+    python serve.py
+
+Главный процесс один раз готовит базу (migrations.prepare_database), затем
+открывает сокет и запускает воркеры; каждый импортирует main с
+SCHEMA_PREPARED=1 и не повторяет create_all() и миграции. Упавший воркер
+перезапускается главным процессом. Сборщик мусора хранилища файлов
+(blobs.py) запускается только в одном из воркеров.
+
+Настройки через переменные окружения:
+    WEB_CONCURRENCY  - количество воркеров (по умолчанию число CPU)
+    HOST, PORT       - адрес (по умолчанию 0.0.0.0:8000)
+    GRACEFUL_TIMEOUT - сколько секунд ждать текущие запросы при остановке (30)
+
+Балансировщику: /health/live - процесс жив, /health/ready - воркер принимает
+запросы (503 при старте, остановке и недоступной базе).
+"""
+import logging
+import os
+
+import uvicorn
+
+import log_config
+import migrations
+from database import engine, sqlite_settings
+
+logger = logging.getLogger("serve")
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8000))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+
+
+def prepare():
+    """Подготовка базы до запуска воркеров"""
+    migrations.prepare_database(engine)
+    logger.info(f"Настройки SQLite: {sqlite_settings()}")
+    # Соединения главного процесса воркерам не нужны
+    engine.dispose()
+    os.environ["SCHEMA_PREPARED"] = "1"
+
+
+def main():
+    log_config.setup_logging()
+    prepare()
+    logger.info(f"Запуск {WEB_CONCURRENCY} воркеров на {HOST}:{PORT}")
+    uvicorn.run(
+        "main:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host=HOST,
+        port=PORT,
+        workers=WEB_CONCURRENCY,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        # Строку доступа пишет log_config.RequestContextMiddleware
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
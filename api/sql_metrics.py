@@ -0,0 +1,107 @@
+"""Подсчет SQL-запросов и их времени в рамках одной операции.
+
+    with sql_metrics.track() as queries:
+        ...
+    queries.count, queries.seconds
+
+Учет идет через события движков (sync и async) и contextvar, поэтому запросы
+из параллельных запросов HTTP не смешиваются: контекст копируется в пул
+потоков и в greenlet асинхронного движка. Вложенные track() (bench.py поверх
+middleware метрик) видят одни и те же запросы.
+
+track(record=True) дополнительно сохраняет текст запросов и место вызова в
+коде приложения (для query_budget.py); это дороже, поэтому только по запросу.
+"""
+import os
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+try:
+    import greenlet
+except ImportError:  # pragma: no cover - greenlet ставится вместе с асинхронным SQLAlchemy
+    greenlet = None
+
+from database import async_engine, engine
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class QueryStats:
+    __slots__ = ("count", "seconds", "parent", "statements")
+
+    def __init__(self, parent: Optional["QueryStats"] = None, record: bool = False):
+        self.count = 0
+        self.seconds = 0.0
+        self.parent = parent
+        self.statements = [] if record else None  # (SQL, место вызова)
+
+
+def call_site() -> str:
+    """Ближайший кадр стека из кода приложения (не SQLAlchemy и не этот модуль)"""
+    frame = sys._getframe(1)
+    # Асинхронный движок выполняет запрос в дочернем greenlet: код эндпоинта
+    # находится в стеке родительского
+    current = greenlet.getcurrent() if greenlet is not None else None
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(BASE_DIR) and filename != __file__:
+            return f"{os.path.basename(filename)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+        if frame is None and current is not None and current.parent is not None:
+            current = current.parent
+            frame = current.gr_frame
+    return "?"
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("sql_metrics_current", default=None)
+_installed = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Время храним в контексте выполнения: при ошибке он просто отбрасывается
+    context._sql_metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._sql_metrics_started
+    stats = _current.get()
+    site = None
+    while stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+        if stats.statements is not None:
+            site = site or call_site()
+            stats.statements.append((" ".join(statement.split()), site))
+        stats = stats.parent
+
+
+def install():
+    """Подключение к движкам (один раз на процесс)"""
+    global _installed
+    if _installed:
+        return
+    for target in (engine, async_engine.sync_engine):
+        event.listen(target, "before_cursor_execute", _before_cursor_execute)
+        event.listen(target, "after_cursor_execute", _after_cursor_execute)
+    _installed = True
+
+
+def current() -> Optional[QueryStats]:
+    return _current.get()
+
+
+@contextmanager
+def track(record: bool = False):
+    install()
+    stats = QueryStats(_current.get(), record)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
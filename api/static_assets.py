@@ -0,0 +1,238 @@
+"""Отдача статики с предсжатием и отпечатками содержимого.
+
+Сборка (запускать при деплое, после изменения templates/):
+
+    python static_assets.py build
+
+Для каждого файла из templates/ считается sha256 и формируется имя с
+отпечатком (assets/Logo.png -> assets/Logo.1a2b3c4d5e.png). В HTML ссылки на
+файлы из src/href/url() заменяются на такие имена. В каталог сборки
+(STATIC_BUILD_DIR, по умолчанию api/static_build) пишутся переписанные HTML,
+сжатые копии .gz/.br для текстовых форматов и manifest.json.
+
+CachedStaticFiles отдает файлы из templates/ с учетом манифеста:
+- URL с отпечатком получают Cache-Control: immutable на год;
+- остальные - no-cache и ETag по содержимому (повторный визит - 304);
+- при Accept-Encoding отдается готовая .br/.gz копия;
+- Range и If-Range обрабатывает FileResponse.
+Без манифеста работает как обычный StaticFiles, но с ETag-валидацией.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import sys
+from typing import Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli не установлен, будет только gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+STATIC_BUILD_DIR = os.getenv("STATIC_BUILD_DIR", os.path.join(BASE_DIR, "static_build"))
+MANIFEST_NAME = "manifest.json"
+
+COMPRESSIBLE_EXTENSIONS = {".html", ".css", ".js", ".json", ".svg", ".txt", ".xml", ".otf", ".ttf", ".ico"}
+MIN_COMPRESS_SIZE = 1024
+HASH_LENGTH = 10
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Ссылки в HTML: src="...", href='...', url(...)
+REFERENCE_RE = re.compile(r"""(?P<prefix>\b(?:src|href)\s*=\s*["']|url\(\s*["']?)(?P<url>[^"')\s]+)""")
+
+
+def _hashed_name(rel_path: str, digest: str) -> str:
+    stem, extension = os.path.splitext(rel_path)
+    return f"{stem}.{digest[:HASH_LENGTH]}{extension}"
+
+
+def _rewrite_html(content: str, files: dict) -> str:
+    def replace(match):
+        url = match.group("url")
+        leading = "/" if url.startswith("/") else ""
+        entry = files.get(url.lstrip("/").removeprefix("./"))
+        if entry is None or entry.get("page"):
+            return match.group(0)
+        return match.group("prefix") + leading + entry["hashed"]
+
+    return REFERENCE_RE.sub(replace, content)
+
+
+def _write_compressed(data: bytes, target: str) -> list:
+    encodings = []
+    if len(data) < MIN_COMPRESS_SIZE:
+        return encodings
+    variants = [("gzip", ".gz", lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.insert(0, ("br", ".br", lambda d: brotli.compress(d, quality=11)))
+    for encoding, suffix, compress in variants:
+        compressed = compress(data)
+        # Сжатие, которое почти ничего не дает, не храним
+        if len(compressed) < len(data) * 0.9:
+            with open(target + suffix, "wb") as f:
+                f.write(compressed)
+            encodings.append(encoding)
+    return encodings
+
+
+def build(source_dir: str = TEMPLATES_DIR, build_dir: str = STATIC_BUILD_DIR) -> dict:
+    files = {}
+    for dirpath, _, names in os.walk(source_dir):
+        for name in names:
+            full_path = os.path.join(dirpath, name)
+            rel_path = os.path.relpath(full_path, source_dir).replace(os.sep, "/")
+            with open(full_path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            files[rel_path] = {
+                "hash": digest,
+                "hashed": _hashed_name(rel_path, digest),
+                "page": rel_path.endswith(".html"),
+                "built": False,
+                "encodings": [],
+            }
+
+    for rel_path, entry in files.items():
+        with open(os.path.join(source_dir, rel_path), "rb") as f:
+            data = f.read()
+        target = os.path.join(build_dir, *rel_path.split("/"))
+        extension = os.path.splitext(rel_path)[1].lower()
+
+        if entry["page"]:
+            # Страницы не переименовываются, но ссылаются на ассеты с отпечатками
+            data = _rewrite_html(data.decode("utf-8"), files).encode("utf-8")
+            entry["hash"] = hashlib.sha256(data).hexdigest()
+            entry["built"] = True
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(data)
+
+        if extension in COMPRESSIBLE_EXTENSIONS:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            entry["encodings"] = _write_compressed(data, target)
+
+    manifest = {"files": files}
+    os.makedirs(build_dir, exist_ok=True)
+    with open(os.path.join(build_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    logger.info(
+        f"Собрано файлов: {len(files)}, предсжатых: "
+        f"{sum(1 for e in files.values() if e['encodings'])}, каталог: {build_dir}"
+    )
+    return manifest
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+
+class CachedStaticFiles(StaticFiles):
+    def __init__(self, *args, build_dir: str = STATIC_BUILD_DIR, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.build_dir = build_dir
+        self.files = {}
+        self.hashed = {}
+        self.load_manifest()
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.build_dir, MANIFEST_NAME), encoding="utf-8") as f:
+                self.files = json.load(f)["files"]
+        except (OSError, ValueError, KeyError):
+            logger.warning("Манифест статики не найден, запустите: python static_assets.py build")
+            self.files = {}
+        self.hashed = {entry["hashed"]: rel_path for rel_path, entry in self.files.items()}
+
+    def get_path(self, scope) -> str:
+        path = super().get_path(scope)
+        original = self.hashed.get(path.replace(os.sep, "/"))
+        if original is not None:
+            scope["static_immutable"] = True
+            return os.path.join(*original.split("/"))
+        return path
+
+    def _rel(self, full_path) -> Optional[str]:
+        for directory in self.all_directories:
+            rel_path = os.path.relpath(full_path, directory)
+            if not rel_path.startswith(".."):
+                return rel_path.replace(os.sep, "/")
+        return None
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        request_headers = Headers(scope=scope)
+        rel_path = self._rel(full_path)
+        entry = self.files.get(rel_path) if rel_path else None
+        if entry is None:
+            headers = {"Cache-Control": REVALIDATE_CACHE_CONTROL}
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+            if self.is_not_modified(response.headers, request_headers):
+                return NotModifiedResponse(response.headers)
+            return response
+
+        media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        path = full_path
+        build_path = os.path.join(self.build_dir, *rel_path.split("/"))
+        if entry["built"]:
+            path = build_path
+
+        headers = {
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL if scope.get("static_immutable") else REVALIDATE_CACHE_CONTROL,
+            "ETag": f'"{entry["hash"][:32]}"',
+        }
+        if entry["encodings"]:
+            headers["Vary"] = "Accept-Encoding"
+            accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+            for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+                if encoding in entry["encodings"] and encoding in accepted:
+                    path = build_path + suffix
+                    headers["Content-Encoding"] = encoding
+                    headers["ETag"] = f'"{entry["hash"][:32]}-{encoding}"'
+                    break
+
+        try:
+            path_stat = stat_result if path == full_path else os.stat(path)
+        except OSError:
+            # Сборка устарела или удалена - отдаем исходный файл
+            path, path_stat = full_path, stat_result
+            headers.pop("Content-Encoding", None)
+            headers["ETag"] = f'"{entry["hash"][:32]}"'
+
+        response = FileResponse(path, status_code=status_code, stat_result=path_stat, headers=headers, media_type=media_type)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """Файлы с хешем содержимого в URL: кешируются без повторной проверки"""
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] != ["build"]:
+        print("Использование: python static_assets.py build")
+        sys.exit(1)
+    build()
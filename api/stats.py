@@ -0,0 +1,203 @@
+"""Инкрементальная статистика курса.
+
+Счетчики хранятся в таблицах stats_rollup и user_stats и меняются в той же
+транзакции, что и исходные данные, поэтому /admin/stats/ читает готовые
+значения, а /admin/users/ сортирует по прогрессу по индексу user_stats.
+Все счетчики ведут триггеры (шаг migrations.py), в том числе при записи в
+обход API (сиды, миграции, ручной SQL): на users - количество пользователей
+и администраторов и строка user_stats нового пользователя, на user_progress -
+пройденные уроки. Разница считается по old/new строки внутри записи,
+поэтому параллельные запросы одного пользователя не считают урок дважды.
+Если агрегаты разошлись с данными, их можно пересчитать:
+
+    python stats.py rebuild
+"""
+import logging
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+TOTAL_LESSONS = 12  # Фиксированное количество уроков
+
+USERS_KEY = "users"
+ADMINS_KEY = "admins"
+COMPLETED_KEY = "completed"
+LESSON_KEY_PREFIX = "lesson:"
+
+
+def _rollup_sql(key: str, delta: str) -> str:
+    """SQL для тела триггера: stats_rollup[key] += delta (key и delta - SQL-выражения)"""
+    return f"""
+        INSERT INTO stats_rollup (key, value) VALUES ({key}, {delta})
+            ON CONFLICT (key) DO UPDATE SET value = value + excluded.value;"""
+
+
+def _admin_sql(row: str) -> str:
+    return f"(COALESCE({row}.is_admin, 0) != 0)"
+
+
+def _users_trigger_ddl() -> list:
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS stats_rollup_users_ai AFTER INSERT ON users BEGIN{
+            _rollup_sql(f"'{USERS_KEY}'", "1")}{_rollup_sql(f"'{ADMINS_KEY}'", _admin_sql("new"))}\nEND""",
+        f"""CREATE TRIGGER IF NOT EXISTS stats_rollup_users_ad AFTER DELETE ON users BEGIN{
+            _rollup_sql(f"'{USERS_KEY}'", "-1")}{_rollup_sql(f"'{ADMINS_KEY}'", f"-{_admin_sql('old')}")}\nEND""",
+        f"""CREATE TRIGGER IF NOT EXISTS stats_rollup_users_au AFTER UPDATE OF is_admin ON users
+            WHEN {_admin_sql("old")} != {_admin_sql("new")} BEGIN{
+            _rollup_sql(f"'{ADMINS_KEY}'", f"{_admin_sql('new')} - {_admin_sql('old')}")}\nEND""",
+    ]
+
+
+def _progress_trigger_ddl() -> list:
+    def bump(row: str, delta: int) -> str:
+        return f"""{_rollup_sql(f"'{COMPLETED_KEY}'", str(delta))}{
+            _rollup_sql(f"'{LESSON_KEY_PREFIX}' || {row}.lesson_id", str(delta))}
+        UPDATE user_stats SET completed_lessons = completed_lessons + {delta} WHERE user_id = {row}.user_id;"""
+
+    def completed(row: str) -> str:
+        return f"COALESCE({row}.is_completed, 0) != 0"
+
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS user_stats_progress_ai AFTER INSERT ON user_progress
+            WHEN {completed("new")} BEGIN{bump("new", 1)}\nEND""",
+        f"""CREATE TRIGGER IF NOT EXISTS user_stats_progress_ad AFTER DELETE ON user_progress
+            WHEN {completed("old")} BEGIN{bump("old", -1)}\nEND""",
+        f"""CREATE TRIGGER IF NOT EXISTS user_stats_progress_au_old AFTER UPDATE ON user_progress
+            WHEN {completed("old")} AND NOT ({completed("new")}
+                AND old.user_id IS new.user_id AND old.lesson_id IS new.lesson_id)
+            BEGIN{bump("old", -1)}\nEND""",
+        f"""CREATE TRIGGER IF NOT EXISTS user_stats_progress_au_new AFTER UPDATE ON user_progress
+            WHEN {completed("new")} AND NOT ({completed("old")}
+                AND old.user_id IS new.user_id AND old.lesson_id IS new.lesson_id)
+            BEGIN{bump("new", 1)}\nEND""",
+    ]
+
+
+def create_triggers(connection: Connection):
+    """Строка user_stats для каждого пользователя и счетчики статистики (шаг миграции)"""
+    existing = {
+        name for (name,) in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'"))
+    }
+    if "user_stats_user_ai" not in existing:
+        connection.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS user_stats_user_ai AFTER INSERT ON users BEGIN
+                INSERT OR IGNORE INTO user_stats (user_id, completed_lessons) VALUES (new.id, 0);
+            END"""))
+        # Пользователи без пройденных уроков, созданные до триггера
+        connection.execute(text(
+            "INSERT OR IGNORE INTO user_stats (user_id, completed_lessons) SELECT id, 0 FROM users"
+        ))
+    if "user_stats_progress_ai" not in existing:
+        # До триггеров счетчики вели эндпоинты, пересчет не нужен
+        for statement in _progress_trigger_ddl():
+            connection.execute(text(statement))
+    if "stats_rollup_users_ai" not in existing:
+        for statement in _users_trigger_ddl():
+            connection.execute(text(statement))
+        # Пользователи, добавленные в обход эндпоинтов до триггеров, не учитывались.
+        # Если агрегатов еще нет, их целиком построит ensure_stats()
+        connection.execute(text(f"""
+            INSERT OR REPLACE INTO stats_rollup (key, value)
+            SELECT key, value FROM (
+                SELECT '{USERS_KEY}' AS key, COUNT(*) AS value FROM users
+                UNION ALL SELECT '{ADMINS_KEY}', COUNT(*) FROM users WHERE COALESCE(is_admin, 0) != 0
+            )
+            WHERE EXISTS (SELECT 1 FROM stats_rollup WHERE key = '{USERS_KEY}')
+        """))
+
+
+# --- Хук для эндпоинта (вызывается до удаления пользователя и db.commit()) ---
+def user_deleted(db: Session, user: models.User):
+    """Удаляет прогресс и строку user_stats пользователя.
+
+    Пройденные уроки снимают триггеры на DELETE из user_progress, счетчики
+    пользователей и администраторов - триггер на DELETE из users.
+    """
+    db.query(models.UserProgress).filter(models.UserProgress.user_id == user.id).delete(synchronize_session=False)
+    db.query(models.UserStats).filter(models.UserStats.user_id == user.id).delete(synchronize_session=False)
+
+
+# --- Чтение и пересчет ---
+def read_stats(db: Session) -> dict:
+    values = dict(db.query(models.StatsRollup.key, models.StatsRollup.value).all())
+    total_users = values.get(USERS_KEY, 0)
+    admin_count = values.get(ADMINS_KEY, 0)
+    completed = values.get(COMPLETED_KEY, 0)
+    avg_progress = completed / (total_users * TOTAL_LESSONS) * 100 if total_users else 0
+    lessons = {
+        int(key[len(LESSON_KEY_PREFIX):]): value
+        for key, value in values.items()
+        if key.startswith(LESSON_KEY_PREFIX) and value
+    }
+    return {
+        "total_users": total_users,
+        "admin_count": admin_count,
+        "regular_users": total_users - admin_count,
+        "avg_progress": round(float(avg_progress), 1),
+        "lesson_completions": dict(sorted(lessons.items())),
+    }
+
+
+def rebuild_stats(db: Session):
+    """Полный пересчет агрегатов по исходным таблицам"""
+    completed_rows = db.query(
+        models.UserProgress.user_id,
+        models.UserProgress.lesson_id
+    ).join(
+        models.User, models.User.id == models.UserProgress.user_id
+    ).filter(
+        models.UserProgress.is_completed == 1
+    ).distinct().all()
+
+    per_user = {user_id: 0 for (user_id,) in db.query(models.User.id)}
+    per_lesson = {}
+    for user_id, lesson_id in completed_rows:
+        per_user[user_id] = per_user.get(user_id, 0) + 1
+        per_lesson[lesson_id] = per_lesson.get(lesson_id, 0) + 1
+
+    rollup = {
+        USERS_KEY: db.query(models.User).count(),
+        ADMINS_KEY: db.query(models.User).filter(func.coalesce(models.User.is_admin, 0) != 0).count(),
+        COMPLETED_KEY: len(completed_rows),
+    }
+    for lesson_id, count in per_lesson.items():
+        rollup[f"{LESSON_KEY_PREFIX}{lesson_id}"] = count
+
+    db.query(models.StatsRollup).delete(synchronize_session=False)
+    db.query(models.UserStats).delete(synchronize_session=False)
+    if rollup:
+        db.execute(insert(models.StatsRollup), [{"key": k, "value": v} for k, v in rollup.items()])
+    if per_user:
+        db.execute(insert(models.UserStats), [
+            {"user_id": user_id, "completed_lessons": count} for user_id, count in per_user.items()
+        ])
+    db.commit()
+    logger.info(f"Статистика пересчитана: {rollup[USERS_KEY]} пользователей, {rollup[COMPLETED_KEY]} пройденных уроков")
+
+
+def ensure_stats(db: Session):
+    """Первичное заполнение агрегатов для существующей базы"""
+    if db.query(models.StatsRollup).filter(models.StatsRollup.key == USERS_KEY).first() is None:
+        rebuild_stats(db)
+
+
+if __name__ == "__main__":
+    import sys
+    from database import SessionLocal, engine
+
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] != ["rebuild"]:
+        print("Использование: python stats.py rebuild")
+        sys.exit(1)
+    models.Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        rebuild_stats(session)
+    finally:
+        session.close()
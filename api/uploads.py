@@ -0,0 +1,194 @@
+"""Потоковое сохранение загружаемых изображений.
+
+Размер тела запроса ограничивает UploadLimitMiddleware (чистый ASGI): байты
+считаются по мере получения из receive, и как только тело превышает лимит
+вида загрузки (плюс запас на заголовки multipart), запрос обрывается с 413.
+Это работает и для chunked-запросов без Content-Length, а разбор multipart
+в Starlette не успевает сохранить во временный файл больше лимита.
+
+Файл читается кусками, запись на диск выполняется в пуле потоков, поэтому
+event loop не блокируется. Во время чтения:
+- проверяется лимит размера для вида загрузки (413 при превышении);
+- по сигнатуре первых байт определяется настоящий тип изображения,
+  расширение берется из него, а не из имени файла;
+- считается SHA-256, по которому файл кладется в хранилище blobs.py
+  (одинаковые загрузки хранятся один раз) и записывается в таблицу blobs.
+Файл пишется во временный .part и переносится в хранилище только целиком.
+"""
+import hashlib
+import os
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+from starlette.datastructures import Headers
+
+import blobs
+
+CHUNK_SIZE = 1024 * 1024
+
+MB = 1024 * 1024
+# Лимиты размера по видам загрузки (в байтах)
+UPLOAD_LIMITS = {
+    "previews": int(os.getenv("UPLOAD_LIMIT_PREVIEWS", 10 * MB)),
+    "images": int(os.getenv("UPLOAD_LIMIT_IMAGES", 20 * MB)),
+    "thumbnails": int(os.getenv("UPLOAD_LIMIT_THUMBNAILS", 5 * MB)),
+}
+# Запас на границы и заголовки частей multipart
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+@dataclass
+class StoredUpload:
+    path: str
+    url: str
+    filename: str
+    sha256: str
+    size: int
+    content_type: str
+    extension: str
+    deduplicated: bool
+
+
+def sniff_image_type(head: bytes) -> Optional[tuple]:
+    """(content_type, расширение) по сигнатуре файла или None"""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png", ".png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg", ".jpg"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif", ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp", ".webp"
+    if head[4:12] in (b"ftypavif", b"ftypavis"):
+        return "image/avif", ".avif"
+    return None
+
+
+class UploadLimitMiddleware:
+    """Лимит тела POST-запросов на маршруты загрузки (routes: путь -> вид загрузки)"""
+
+    def __init__(self, app, routes: dict):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        kind = self.routes.get(scope["path"]) if scope["type"] == "http" else None
+        if kind is None or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        max_body = UPLOAD_LIMITS[kind] + MULTIPART_OVERHEAD
+        content_length = Headers(scope=scope).get("content-length")
+        # Ранний отказ по заголовку, до чтения тела
+        if content_length and content_length.isdigit() and int(content_length) > max_body:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        rejected = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request" and not started:
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    # Приложение видит обрыв соединения и прекращает разбор формы.
+                    # Исключение отсюда BaseHTTPMiddleware завернул бы в ExceptionGroup,
+                    # и FastAPI ответил бы 400
+                    rejected = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            # Ответ приложения на оборванный запрос заменяется на 413
+            if rejected and not started:
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected or started:
+                raise
+        if rejected and not started:
+            await self._reject(scope, receive, send)
+
+    @staticmethod
+    async def _reject(scope, receive, send):
+        response = JSONResponse(status_code=413, content={"detail": "Файл слишком большой"})
+        await response(scope, receive, send)
+
+
+def _open(path: str):
+    return open(path, "wb")
+
+
+async def save_upload(file: UploadFile, kind: str, db: Session) -> StoredUpload:
+    limit = UPLOAD_LIMITS[kind]
+    await run_in_threadpool(os.makedirs, blobs.TEMP_DIR, exist_ok=True)
+
+    temp_path = os.path.join(blobs.TEMP_DIR, f"{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    image_type = None
+    buffer = await run_in_threadpool(_open, temp_path)
+    try:
+        while True:
+            chunk = await file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if image_type is None:
+                image_type = sniff_image_type(chunk[:16])
+                if image_type is None:
+                    raise HTTPException(status_code=400, detail="Файл должен быть изображением")
+            size += len(chunk)
+            if size > limit:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Файл слишком большой (максимум {limit // MB} МБ)"
+                )
+            digest.update(chunk)
+            await run_in_threadpool(buffer.write, chunk)
+        await run_in_threadpool(buffer.close)
+        if image_type is None:
+            raise HTTPException(status_code=400, detail="Пустой файл")
+
+        content_type, extension = image_type
+        sha256 = digest.hexdigest()
+        path, deduplicated = await run_in_threadpool(
+            blobs.store_file, db, temp_path, sha256, extension, size, content_type
+        )
+    except BaseException:
+        await run_in_threadpool(buffer.close)
+        await run_in_threadpool(_remove_quietly, temp_path)
+        raise
+
+    return StoredUpload(
+        path=path,
+        url=blobs.blob_url(sha256, extension),
+        filename=os.path.basename(path),
+        sha256=sha256,
+        size=size,
+        content_type=content_type,
+        extension=extension,
+        deduplicated=deduplicated,
+    )
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,45 @@
+"""Версия данных, общая для всех воркеров.
+
+Процесс, изменивший данные, перезаписывает файл рядом с БД (touch()), а
+остальные при следующем обращении к своему кешу замечают это через changed()
+- один os.stat, без обращения к SQLite. Файл заменяется атомарно
+(os.replace), поэтому отпечаток (inode, mtime) меняется при каждой записи,
+даже если две записи попали в один тик часов файловой системы.
+"""
+import logging
+import os
+import time
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class VersionFile:
+    def __init__(self, path: str):
+        self.path = path
+        self._stamp = self._read()
+
+    def _read(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def changed(self) -> bool:
+        """Файл изменен другим процессом после последней проверки"""
+        stamp = self._read()
+        if stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        return True
+
+    def touch(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(str(time.time_ns()))
+            os.replace(tmp_path, self.path)
+            self._stamp = self._read()
+        except OSError as e:
+            logger.error(f"Не удалось обновить файл версии {self.path}: {str(e)}")